@@ -0,0 +1,299 @@
+"""
+Benchmarks of the generation and rendering hot paths.
+They run on a temporary app folder with the default scales, rhythms and weights
+
+python -m benchmarks.run -o results.json
+python -m benchmarks.run -o new.json --compare results.json
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+# Set before src.service is imported, it reads them at import time
+_APP_DIR = tempfile.mkdtemp(prefix="four_bars_bench_")
+atexit.register(shutil.rmtree, _APP_DIR, ignore_errors=True)
+os.environ["FOUR_BARS_APP_DIR"] = _APP_DIR
+os.environ.pop("FOUR_BARS_RENDER_CACHE", None)
+
+from src.default import DEFAULT_RHYTHMS, DEFAULT_SCALES
+from src.service import (
+    Service, Grid, MelodyData, MelodyEngine, MidiBackend, Triad, RENDER_CACHE,
+    _get_chord_tone_index, _get_melody_model, _get_random_melody, _get_weighted_melody, _get_rhythm_scheme, _get_rhythm_stream, _get_scale_pitches, _rhythm_streams
+)
+from src.utils.latency import LatencyRecorder
+from src.utils.library import Library
+from src.utils.midi_file import read_messages
+from src.utils.sequencer import RecordingSink, Sequencer
+from src.utils.yaml_file import YAMLFile
+
+SEED = 4
+SCALE_NAME = "Am I-I"
+RHYTHM_NAME = "8s"
+CHORDS = ["Am", "F", "C", "G"]
+GRIDS = [Grid.EIGHTS, Grid.SIXTEENTHS]
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+
+
+def _params(
+        grid: Grid,
+        backend: MidiBackend = MidiBackend.NATIVE,
+        engine: MelodyEngine = MelodyEngine.UNIFORM
+) -> Service.Params:
+    return Service.Params(
+        bars=[
+            Service.Params.BarParams(chord=Triad(c), active=True, melody_data=MelodyData.empty(grid))
+            for c in CHORDS
+        ],
+        scale_name=SCALE_NAME,
+        note_count=grid.value // 2,
+        grid=grid,
+        chord_tones_threshold=0.3,
+        rhythm_name=RHYTHM_NAME,
+        midi_backend=backend,
+        melody_engine=engine
+    )
+
+
+def _bench_random_melody(grid: Grid) -> Callable:
+    pitches = _get_scale_pitches(SCALE_NAME)
+    chord_tone_indices = _get_chord_tone_index(SCALE_NAME)[CHORDS[0]]
+    return lambda: _get_random_melody(pitches, grid.value // 2, grid, chord_tone_indices, 0.3, SEED)
+
+
+def _bench_weighted_melody(grid: Grid) -> Callable:
+    model = _get_melody_model(SCALE_NAME)
+    chord = Triad(CHORDS[0])
+    return lambda: _get_weighted_melody(model, grid.value // 2, grid, chord, 0.3, SEED)
+
+
+def _bench_rhythm_scheme() -> Callable:
+    chord = Triad(CHORDS[0])
+    return lambda: _get_rhythm_scheme(RHYTHM_NAME, chord)
+
+
+def _bench_rhythm_stream() -> Callable:
+    chord = Triad(CHORDS[0])
+
+    def run():
+        _rhythm_streams.clear()
+        _get_rhythm_stream(RHYTHM_NAME, chord)
+
+    return run
+
+
+def _bench_melody_sum(grid: Grid) -> Callable:
+    from src.notation import Melody
+    melodies = [md.melody for md in Service.generate(_params(grid))]
+    return lambda: Melody.sum(melodies)
+
+
+def _bench_render_midi(grid: Grid, backend: MidiBackend) -> Callable:
+    params = _params(grid, backend)
+    melodies_data = Service.generate(params)
+
+    def run():
+        RENDER_CACHE.clear()
+        return Service.render_midi(params, melodies_data)
+
+    return run
+
+
+def _bench_generate_batch(grid: Grid, n: int, engine: MelodyEngine = MelodyEngine.UNIFORM) -> Callable:
+    params = _params(grid, engine=engine)
+    return lambda: Service.generate_batch(params, n, SEED)
+
+
+def _bench_yaml_read(tmp_dir: Path, name: str, data: dict) -> Callable:
+    yaml_file = YAMLFile(tmp_dir / f"{name}.yml")
+    yaml_file.write(data)
+    return yaml_file.read
+
+
+def _bench_library_search(tmp_dir: Path, n: int) -> Callable:
+    library = Library(tmp_dir / f"library_{n}.sqlite3")
+    scale = DEFAULT_SCALES[SCALE_NAME]
+    library.import_entries("scales", "bench", {f"Scale {i}": {"pitches": scale, "tags": [f"t{i % 10}"]} for i in range(n)})
+    return lambda: (library.names("scales", "12", limit=20), library.get("scales", f"Scale {n // 2}"))
+
+
+def _bench_build_cells(grid: Grid) -> Callable:
+    import flet as ft
+    from src.ui import BarsContainer
+    row = BarsContainer.BarRow(grid)
+    row._switch = ft.Switch(value=True)
+    row._melody_data = Service.generate(_params(grid))[0]
+    return row._build_cells_for_melody_data
+
+
+def _bench_sequencer_start() -> Callable:
+    sequencer = Sequencer(RecordingSink(), LatencyRecorder())
+    messages = [(0.0, bytes([0x90, 60, 90])), (0.0, bytes([0x80, 60, 0]))]
+
+    def run():
+        sequencer.play(messages)
+        sequencer.wait()
+
+    return run
+
+
+def measure_sequencer(speed: float = 8) -> dict[str, dict]:
+    """
+    Start latency and jitter of the sequencer playing the rendered bars speed times faster
+    """
+
+    params = _params(Grid.SIXTEENTHS)
+    messages = read_messages(Service.render_midi(params, Service.generate(params)))
+    latency = LatencyRecorder(enabled=True)
+    sequencer = Sequencer(RecordingSink(), latency)
+    sequencer.play([(at / speed, message) for at, message in messages])
+    sequencer.wait()
+    sequencer.close()
+    return latency.report()
+
+
+def _get_benchmarks(tmp_dir: Path) -> list[tuple[str, dict, Callable[[], Callable]]]:
+
+    benchmarks = [
+        ("rhythm_scheme", {}, _bench_rhythm_scheme),
+        ("rhythm_stream", {}, _bench_rhythm_stream),
+        ("yaml_read", {"file": "scales"}, lambda: _bench_yaml_read(tmp_dir, "scales", DEFAULT_SCALES)),
+        ("yaml_read", {"file": "rhythms"}, lambda: _bench_yaml_read(tmp_dir, "rhythms", DEFAULT_RHYTHMS)),
+        ("library_search", {"entries": 10000}, lambda: _bench_library_search(tmp_dir, 10000)),
+        ("sequencer_start", {}, _bench_sequencer_start),
+    ]
+
+    for grid in GRIDS:
+        benchmarks += [
+            ("random_melody", {"grid": grid.value}, lambda g=grid: _bench_random_melody(g)),
+            ("weighted_melody", {"grid": grid.value}, lambda g=grid: _bench_weighted_melody(g)),
+            ("melody_sum", {"grid": grid.value}, lambda g=grid: _bench_melody_sum(g)),
+            ("build_cells", {"grid": grid.value}, lambda g=grid: _bench_build_cells(g)),
+        ]
+        for backend in MidiBackend:
+            benchmarks.append((
+                "render_midi",
+                {"grid": grid.value, "backend": backend.value},
+                lambda g=grid, b=backend: _bench_render_midi(g, b)
+            ))
+        for n in BATCH_SIZES:
+            benchmarks.append((
+                "generate_batch",
+                {"grid": grid.value, "n": n},
+                lambda g=grid, n=n: _bench_generate_batch(g, n)
+            ))
+            benchmarks.append((
+                "generate_batch",
+                {"grid": grid.value, "n": n, "engine": MelodyEngine.WEIGHTED.value},
+                lambda g=grid, n=n: _bench_generate_batch(g, n, MelodyEngine.WEIGHTED)
+            ))
+
+    return benchmarks
+
+
+def _measure(func: Callable, repeat: int) -> dict:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0
+    }
+
+
+def _key(result: dict) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+def run(repeat: int, name_filter: Optional[str] = None) -> dict:
+
+    Service.init_app_dir(background_tasks=False)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, params, setup in _get_benchmarks(Path(tmp_dir)):
+            if name_filter and name_filter not in name:
+                continue
+            random.seed(SEED)
+            np.random.seed(SEED)
+            result = {"name": name, "params": params, **_measure(setup(), repeat)}
+            results.append(result)
+            print(f"{_key(result):<50} {result['median'] * 1e6:>12.1f} us")
+
+    sequencer = {}
+    if not name_filter or name_filter in "sequencer":
+        sequencer = measure_sequencer()
+        for name, r in sequencer.items():
+            print(f"{name:<50} mean={r['mean_ms']:.3f}ms p99={r['p99_ms']:.3f}ms max={r['max_ms']:.3f}ms")
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": SEED,
+        "results": results,
+        "sequencer": sequencer
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Keys of benchmarks whose median became slower than baseline by more than tolerance
+    """
+
+    baseline_results = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        key = _key(result)
+        if key not in baseline_results:
+            continue
+        ratio = result["median"] / baseline_results[key]["median"]
+        print(f"{key:<50} {ratio:>8.2f}x")
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("-o", "--output", type=Path, help="Write results to JSON file")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown, 0.1 is 10%%")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-k", "--filter", help="Run only benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.filter)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
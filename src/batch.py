@@ -0,0 +1,120 @@
+"""
+Headless batch rendering
+
+python -m src.batch -s "Am I-I" -r 4s -c Am F C G -n 10000 -o library.zip
+"""
+
+import argparse
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.service import Service, Grid, MelodyData, MelodyEngine, Triad, LIBRARY, MAJOR_CHORDS, MINOR_CHORDS
+from src.utils.folder import Folder
+
+
+def _render_chunk(
+        params: Service.Params,
+        start: int,
+        n: int,
+        seed: np.random.SeedSequence
+) -> list[tuple[int, bytes]]:
+    batch = Service.generate_batch(params, n, seed)
+    return [(start + i, batch.midi(i)) for i in range(n)]
+
+
+def _open_sink(output: Path, stack: ExitStack) -> Callable[[str, bytes], None]:
+
+    if output.suffix == ".zip":
+        archive = stack.enter_context(zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED))
+        return archive.writestr
+
+    folder = Folder(output, auto_create=True)
+
+    def write(filename: str, data: bytes) -> None:
+        with open(folder.path / filename, "wb") as file:
+            file.write(data)
+
+    return write
+
+
+def _parse_args(argv: Optional[list[str]]) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(prog="python -m src.batch", description="Render N variations to MIDI files")
+    parser.add_argument("-s", "--scale", required=True)
+    parser.add_argument("-r", "--rhythm")
+    parser.add_argument("-g", "--grid", type=int, choices=[g.value for g in Grid], default=Grid.EIGHTS.value)
+    parser.add_argument("--note-count", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=0.3, help="Chord tones threshold, 0..1")
+    parser.add_argument("-e", "--engine", choices=[e.value for e in MelodyEngine], default=MelodyEngine.UNIFORM.value)
+    parser.add_argument("-c", "--chords", nargs="+", choices=MAJOR_CHORDS + MINOR_CHORDS, required=True)
+    parser.add_argument("-n", "--count", type=int, default=100)
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Directory or .zip archive")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    Service.init_app_dir(background_tasks=False)
+    if args.scale not in Service.get_scale_names():
+        parser.error(f"unknown scale {args.scale!r}")
+    if args.rhythm is not None and args.rhythm not in Service.get_rhythm_names():
+        parser.error(f"unknown rhythm {args.rhythm!r}")
+
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+
+    args = _parse_args(argv)
+
+    grid = Grid(args.grid)
+    params = Service.Params(
+        bars=[
+            Service.Params.BarParams(chord=Triad(c), active=True, melody_data=MelodyData.empty(grid))
+            for c in args.chords
+        ],
+        scale_name=args.scale,
+        note_count=args.note_count,
+        grid=grid,
+        chord_tones_threshold=args.threshold,
+        rhythm_name=args.rhythm,
+        melody_engine=MelodyEngine(args.engine)
+    )
+
+    chunks = [(start, min(args.chunk_size, args.count - start)) for start in range(0, args.count, args.chunk_size)]
+    seeds = np.random.SeedSequence(args.seed).spawn(len(chunks))
+    digits = len(str(args.count))
+
+    start_time = time.perf_counter()
+    total_bytes = 0
+
+    # SQLite connections must not be used across a fork, workers open their own
+    LIBRARY.close()
+
+    with ExitStack() as stack:
+        write = _open_sink(args.output, stack)
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.workers))
+        futures = [
+            executor.submit(_render_chunk, params, start, n, seed)
+            for (start, n), seed in zip(chunks, seeds)
+        ]
+        for future in as_completed(futures):
+            for idx, data in future.result():
+                write(f"{idx + 1:0{digits}d}.mid", data)
+                total_bytes += len(data)
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Rendered {args.count} variations ({total_bytes / 1e6:.1f} MB) to {args.output} "
+        f"in {elapsed:.2f} s, {args.count / elapsed:.0f} variations/s"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 """
-Default content for scales.yml and rhythms.yml
+Default content for scales.yml, rhythms.yml and weights.yml
 """
 
 DEFAULT_SCALES = {
@@ -76,3 +76,16 @@ DEFAULT_RHYTHMS = {
           "5":   "----------------"
         }
 }
+
+# Weighted melody engine, per scale name or "default" for the rest.
+# degrees: weight of each scale degree, repeated over the pitches of the scale
+# intervals: weight of a step by 0, 1, 2... scale pitches, longer steps are not taken
+# contour: -1 for descending lines ... 1 for ascending ones
+DEFAULT_WEIGHTS = {
+    "default":
+        {
+            "degrees": [3, 1, 2, 1, 2, 1, 1],
+            "intervals": [1, 8, 5, 3, 2, 1, 1, 1],
+            "contour": 0.0
+        }
+}
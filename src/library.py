@@ -0,0 +1,50 @@
+"""
+Scale and rhythm library maintenance
+
+python -m src.library import scales shared_scales.yml
+python -m src.library export rhythms rhythms_backup.yml
+python -m src.library search scales "Am" --tag minor
+"""
+
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from src.service import Service, LibraryKind
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+
+    parser = argparse.ArgumentParser(prog="python -m src.library", description="Import, export and search the library")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for command in ["import", "export"]:
+        subparser = commands.add_parser(command)
+        subparser.add_argument("kind", choices=[k.value for k in LibraryKind])
+        subparser.add_argument("path", type=Path, help="YAML file in the format of scales.yml or rhythms.yml")
+
+    subparser = commands.add_parser("search")
+    subparser.add_argument("kind", choices=[k.value for k in LibraryKind])
+    subparser.add_argument("query", nargs="?", default="")
+    subparser.add_argument("-t", "--tag")
+    subparser.add_argument("-n", "--limit", type=int, default=50)
+
+    args = parser.parse_args(argv)
+    kind = LibraryKind(args.kind)
+
+    Service.init_app_dir(background_tasks=False)
+
+    if args.command == "import":
+        changed = Service.import_library(kind, args.path)
+        print(f"Imported {args.path}, {len(changed)} {kind.value} changed")
+    elif args.command == "export":
+        Service.export_library(kind, args.path)
+        print(f"Exported {Service.count_library(kind)} {kind.value} to {args.path}")
+    else:
+        for name in Service.search_library(kind, args.query, args.tag, limit=args.limit):
+            print(name)
+        print(f"{Service.count_library(kind, args.query, args.tag)} found")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,35 @@
 Entry point
 """
 
+import atexit
+import threading
+
 import flet as ft
 from loguru import logger
 
-from src.service import APP_DIR
-from src.ui import AppBar, MainStack
+from src.utils.latency import LATENCY
+from src.utils.phase_timer import PhaseTimer
+
+startup_timer = PhaseTimer("startup")
+
+with startup_timer.phase("imports"):
+    from src.service import APP_DIR, Service
+    from src.ui import AppBar, MainStack
 
 
 logger.add(APP_DIR / "error.log", format="{time} {level} {message}", level="ERROR")
+atexit.register(Service.stop_playback)
+
+if LATENCY.enabled:
+    LATENCY.log_periodically(60)
+    atexit.register(LATENCY.save_json, APP_DIR / "latency.json")
 
 
 def main(page: ft.Page):
 
+    with startup_timer.phase("app dir"):
+        Service.init_app_dir()
+
     page.title = "Four Bars"
     page.window.width = 820
     page.window.height = 520
@@ -28,12 +45,20 @@ def main(page: ft.Page):
     app_bar = AppBar(
         on_btn_settings_click=main_stack.on_btn_settings_click,
         on_btn_refresh_click=main_stack.on_btn_refresh_click,
-        on_btn_folder_click=main_stack.on_btn_folder_click
+        on_btn_folder_click=main_stack.on_btn_folder_click,
+        on_btn_undo_click=main_stack.on_btn_undo_click,
+        on_btn_redo_click=main_stack.on_btn_redo_click
     )
 
+    main_stack.on_history_change = app_bar.set_history_state
+
     page.appbar = app_bar
     page.main_stack = main_stack
-    page.add(main_stack)
+    with startup_timer.phase("first frame"):
+        page.add(main_stack)
+    startup_timer.mark("time to first frame")
+
+    threading.Thread(target=startup_timer.timed("music21 import", Service.preload), daemon=True).start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+"""
+music21 part, imported on first use
+"""
+
+from __future__ import annotations
+
+import copy
+from os import PathLike
+from typing import Iterable
+
+from music21.chord import Chord
+from music21.midi.translate import streamToMidiFile
+from music21.note import Pitch, Note, Rest, Duration
+from music21.stream import Stream
+
+from src.utils.latency import LATENCY
+
+
+class Melody(Stream):
+
+    def __str__(self) -> str:
+        return str(list(self))
+
+    def __add__(self, other: Stream) -> Melody:
+        return Melody.sum([self, other])
+
+    def save_midi(self, path: PathLike):
+        self.write("midi", path)
+
+    @classmethod
+    def sum(cls, melodies: list[Stream]) -> Melody:
+        """
+        Concatenates streams in one pass, every element is copied only once
+        """
+        result = cls()
+        result.append([copy.deepcopy(e) for melody in melodies for e in melody])
+        return result
+
+
+def melody_from_notes(notes: Iterable[int], cell_length: float) -> Melody:
+    cell_duration = Duration(quarterLength=cell_length)
+    melody_objects = []
+    for note in notes:
+        if note >= 0:
+            melody_objects.append(Note(pitch=Pitch(midi=note), duration=cell_duration))
+        else:
+            melody_objects.append(Rest(duration=cell_duration))
+    return Melody(melody_objects)
+
+
+def rhythm_stream(rhythm_scheme: Iterable[Iterable[int]], velocity: int) -> Stream:
+
+    result = Stream()
+
+    duration = Duration(quarterLength=0.25)
+    for pitches in rhythm_scheme:
+        chord_notes = []
+        for pitch in pitches:
+            note = Note(Pitch(midi=pitch), duration=duration)
+            note.volume.velocity = velocity
+            chord_notes.append(note)
+
+        if chord_notes:
+            result.append(Chord(chord_notes))
+        else:
+            result.append(Rest(duration=duration))
+
+    return result
+
+
+def render_midi(melodies: list[Melody], rhythm_streams: list[Stream]) -> bytes:
+    with LATENCY.span("service.sum"):
+        melody_4 = Melody.sum(melodies)
+        rhythm = Melody.sum(rhythm_streams)
+    with LATENCY.span("service.midi_write"):
+        stream = Stream()
+        stream.insert(0, melody_4)
+        stream.insert(0, rhythm)
+        return streamToMidiFile(stream).writestr()
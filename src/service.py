@@ -4,38 +4,70 @@ Backend part
 
 from __future__ import annotations
 
-import copy
+import hashlib
+import itertools
+import json
 import math
 import os
 import random
+import struct
+import threading
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
-from functools import lru_cache
 from os import PathLike
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator, NamedTuple, Optional, Sequence, Union
 
-from music21.chord import Chord
-from music21.note import Pitch, Note, Rest, Duration
-from music21.stream import Stream
+import numpy as np
+from loguru import logger
 
-from src.default import DEFAULT_SCALES, DEFAULT_RHYTHMS
-from src.utils.yaml_file import YAMLFile
+from src.default import DEFAULT_SCALES, DEFAULT_RHYTHMS, DEFAULT_WEIGHTS
+from src.utils.alias_table import AliasTable
+from src.utils.bytes_cache import BytesCache
+from src.utils.library import Library
+from src.utils.yaml_file import CachedYAMLFile, YAMLFile
 from src.utils.folder import Folder
-
-
-APP_DIR = Path.home() / ".four_bars"
-APP_FOLDER = Folder(APP_DIR, auto_create=True)
-MIDI_FOLDER = Folder(APP_DIR / "midi", auto_create=True)
-MIDI_FOLDER.clear()
-SCALES_YML = YAMLFile(APP_DIR / "scales.yml", auto_create=True)
-RHYTHMS_YML = YAMLFile(APP_DIR / "rhythms.yml", auto_create=True)
-
-if not SCALES_YML.read():
-    SCALES_YML.write(DEFAULT_SCALES)
-
-if not RHYTHMS_YML.read():
-    RHYTHMS_YML.write(DEFAULT_RHYTHMS)
+from src.utils.latency import LATENCY
+from src.utils.latest_executor import CancelToken
+from src.utils.retention import RetentionPolicy
+from src.utils.sequence_file import SequenceFile
+from src.utils.midi_file import EncodedChunk, MidiFile, MidiStreamWriter, NoteEvent, encode_chunk, join_chunks, read_messages
+from src.utils.sequencer import MidiSink, RtMidiSink, Sequencer
+
+if TYPE_CHECKING:
+    from music21.pitch import Pitch
+    from music21.stream import Stream
+    from src.notation import Melody
+
+
+# FOUR_BARS_APP_DIR points the app at another folder, e.g. a temporary one for benchmarks and tests
+APP_DIR = Path(os.environ.get("FOUR_BARS_APP_DIR") or Path.home() / ".four_bars")
+APP_FOLDER = Folder(APP_DIR)
+MIDI_FOLDER = Folder(APP_DIR / "midi")
+SCALES_YML = CachedYAMLFile(APP_DIR / "scales.yml")
+RHYTHMS_YML = CachedYAMLFile(APP_DIR / "rhythms.yml")
+WEIGHTS_YML = CachedYAMLFile(APP_DIR / "weights.yml")
+LIBRARY = Library(APP_DIR / "library.sqlite3")
+RHYTHM_CACHE_FOLDER = Folder(APP_DIR / "rhythm_cache")
+MIDI_SEQUENCE = SequenceFile(APP_DIR / "midi_sequence.txt", initial=lambda: _get_last_midi_number())
+# Output port of the built-in playback is the first one whose name contains FOUR_BARS_MIDI_OUT
+MIDI_OUT_PORT = os.environ.get("FOUR_BARS_MIDI_OUT", "")
+MIDI_RETENTION = RetentionPolicy(max_files=1000, max_bytes=64 * 1024 * 1024, max_age=30 * 24 * 60 * 60)
+# Retention is applied at startup and then once per this many saved files,
+# MIDI_FOLDER may exceed its limits by that many files in between
+MIDI_RETENTION_INTERVAL = 100
+
+# Rendered MIDI by content hash, the on-disk tier is kept only with FOUR_BARS_RENDER_CACHE=1
+RENDER_CACHE_FOLDER = Folder(APP_DIR / "render_cache")
+RENDER_CACHE_RETENTION = RetentionPolicy(max_files=5000, max_bytes=32 * 1024 * 1024, max_age=30 * 24 * 60 * 60)
+RENDER_CACHE = BytesCache(
+    max_bytes=8 * 1024 * 1024,
+    folder=RENDER_CACHE_FOLDER if os.environ.get("FOUR_BARS_RENDER_CACHE", "") not in ("", "0") else None,
+    suffix=".mid"
+)
 
 MAJOR_CHORDS = [
     "C", "G", "D", "A", "E", "B", "F#", "C#", "G#", "D#", "A#", "F"
@@ -45,22 +77,76 @@ MINOR_CHORDS = [
     "Am", "Em", "Bm", "F#m", "C#m", "G#m", "D#m", "A#m", "Fm", "Cm", "Gm", "Dm"
 ]
 
+# Semitones from the root in major and minor chords
+RHYTHM_DEGREES = {
+    "5": (-5, -5),
+    "i": (0, 0),
+    "iii": (4, 3),
+    "v": (7, 7),
+    "I": (12, 12),
+    "III": (16, 15)
+}
+
+PITCH_CLASSES = {
+    "C": 0, "C#": 1, "D": 2, "D#": 3, "E": 4, "F": 5,
+    "F#": 6, "G": 7, "G#": 8, "A": 9, "A#": 10, "B": 11
+}
+
+# Names of pitch classes spelled as chords are, for notes out of the scale
+PITCH_CLASS_NAMES = list(PITCH_CLASSES)
+
+# MIDI note numbers of chord roots in the rhythm track
+RHYTHM_ROOTS = {
+    "A": 45,  # A2
+    "A#": 46,  # A#2
+    "B": 47,  # B2
+    "C": 48,  # C3
+    "C#": 48,  # C3
+    "D": 50,  # D3
+    "D#": 39,  # D#2
+    "E": 40,  # E2
+    "F": 41,  # F2
+    "F#": 42,  # F#2
+    "G": 43,  # G2
+    "G#": 44  # G#2
+}
+
+RhythmScheme = tuple[tuple[int, ...], ...]
+EMPTY_RHYTHM_SCHEME: RhythmScheme = ((),) * 16
+
+TEMPO = 120
+TICKS_PER_QUARTER = 10080
+MELODY_VELOCITY = 90
+RHYTHM_VELOCITY = 48
+EMPTY_RHYTHM_CHUNK = EncodedChunk(0, b"", 4 * TICKS_PER_QUARTER)
+
 
 class Grid(Enum):
     EIGHTS = 8
     SIXTEENTHS = 16
 
 
-class Triad(Chord):
+class MidiBackend(Enum):
+    NATIVE = "native"
+    MUSIC21 = "music21"
+
+
+class MelodyEngine(Enum):
+    UNIFORM = "uniform"
+    WEIGHTED = "weighted"
+
+
+class LibraryKind(Enum):
+    SCALES = "scales"
+    RHYTHMS = "rhythms"
+
+
+class Triad:
 
     def __init__(self, name: str):
         self._name = name
         self._is_major = not name.endswith("m")
-        tonic_name = name if self._is_major else name[:-1]
-        tonic = Pitch(tonic_name)
-        third = Pitch(tonic_name).transpose(4 if self._is_major else 3)
-        fifth = Pitch(tonic_name).transpose(7)
-        super(Triad, self).__init__([tonic, third, fifth])
+        self._tonic_name = name if self._is_major else name[:-1]
 
     @property
     def name(self) -> str:
@@ -70,173 +156,835 @@ class Triad(Chord):
     def is_major(self) -> bool:
         return self._is_major
 
+    @property
+    def tonic_name(self) -> str:
+        return self._tonic_name
 
-class Melody(Stream):
+    @property
+    def pitch_classes(self) -> tuple[int, int, int]:
+        tonic = PITCH_CLASSES[self._tonic_name]
+        third = (tonic + (4 if self._is_major else 3)) % 12
+        fifth = (tonic + 7) % 12
+        return tonic, third, fifth
 
-    def __str__(self) -> str:
-        return str(list(self))
 
-    def __add__(self, other) -> Melody:
-        other = copy.deepcopy(other)
-        melody = copy.deepcopy(self)
-        melody.append(list(other))
-        return melody
+class MelodyData:
+    """
+    Compact bar melody: MIDI note numbers per grid cell, -1 is a rest.
+    melody is for service, labels are for ui, both are built on demand.
+    seed is the seed of the RNG the bar was generated with, if any
+    """
 
-    def save_midi(self, path: PathLike):
-        self.write("midi", path)
+    __slots__ = ("_notes", "_grid", "_seed", "_melody")
 
-    @classmethod
-    def sum(cls, melodies: list[Melody]) -> Melody:
-        result = Melody()
-        for melody in melodies:
-            result += melody
-        return result
+    def __init__(self, notes: Iterable[int], grid: Grid, seed: Optional[int] = None) -> None:
+        self._notes = array("b", notes)
+        self._grid = grid
+        self._seed = seed
+        self._melody: Optional[Melody] = None
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MelodyData):
+            return NotImplemented
+        return self._grid == other._grid and self._notes == other._notes
 
-@dataclass
-class MelodyData:
-    """
-    melody is for service, scheme is for ui
-    """
+    def __repr__(self) -> str:
+        return f"MelodyData({self._notes.tolist()}, {self._grid})"
 
-    melody: Optional[Melody] = None
-    scheme: list[Optional[Pitch]] = None
+    @property
+    def notes(self) -> array:
+        return self._notes
+
+    @property
+    def grid(self) -> Grid:
+        return self._grid
+
+    @property
+    def seed(self) -> Optional[int]:
+        return self._seed
+
+    @property
+    def melody(self) -> Melody:
+        if self._melody is None:
+            from src.notation import melody_from_notes
+            self._melody = melody_from_notes(self._notes, 4 / self._grid.value)
+        return self._melody
+
+    def labels(self, note_names: Optional[dict[int, str]] = None) -> list[Optional[str]]:
+        """
+        Pitch names of the notes spelled as in note_names, e.g. Service.get_note_names of the scale,
+        other notes are spelled with PITCH_CLASS_NAMES
+        """
+        note_names = note_names or {}
+        return [
+            note_names.get(note) or PITCH_CLASS_NAMES[note % 12] if note >= 0 else None
+            for note in self._notes
+        ]
 
     @classmethod
-    def empty(cls, grid: Grid):
-        return cls(Melody(), [None] * grid.value)
+    def empty(cls, grid: Grid) -> MelodyData:
+        return cls([-1] * grid.value, grid)
 
 
 def _get_random_melody(
         pitch_set: list[Pitch],
         note_count: int,
         grid: Grid,
-        chord: Optional[Chord] = None,
-        chord_tones_threshold: Optional[float] = 1.0
+        chord_tone_indices: Optional[Sequence[int]] = None,
+        chord_tones_threshold: Optional[float] = 1.0,
+        seed: Optional[int] = None
 ) -> MelodyData:
 
+    rng = random.Random(seed)
     cells = [None] * grid.value
 
-    if not pitch_set:
-        return MelodyData(Melody(), cells)
-
-    if note_count < 1:
-        return MelodyData(Melody(), cells)
+    if not pitch_set or note_count < 1:
+        return MelodyData([-1] * grid.value, grid, seed)
 
     note_count = min([note_count, grid.value])
 
     grid_indices = list(range(grid.value))
-    note_indices = random.sample(grid_indices, k=note_count)
+    note_indices = rng.sample(grid_indices, k=note_count)
     note_indices.sort()
 
-    if not chord:
-        pitches = random.choices(pitch_set, k=note_count)
+    if not chord_tone_indices:
+        pitches = rng.choices(pitch_set, k=note_count)
     else:
-        chord_pitch_names = [p.name for p in chord.pitches]
-        chord_tones = [p for p in pitch_set if p.name in chord_pitch_names]
-        if not chord_tones:
-            pitches = random.choices(pitch_set, k=note_count)
-        else:
-            chord_note_count = math.ceil(note_count * chord_tones_threshold)
-            any_note_count = note_count - chord_note_count
-            chord_pitches = random.choices(chord_tones, k=chord_note_count)
-            any_pitches = random.choices(pitch_set, k=any_note_count)
-            pitches = chord_pitches + any_pitches
-            random.shuffle(pitches)
+        chord_tones = [pitch_set[i] for i in chord_tone_indices]
+        chord_note_count = math.ceil(note_count * chord_tones_threshold)
+        any_note_count = note_count - chord_note_count
+        chord_pitches = rng.choices(chord_tones, k=chord_note_count)
+        any_pitches = rng.choices(pitch_set, k=any_note_count)
+        pitches = chord_pitches + any_pitches
+        rng.shuffle(pitches)
 
     for note_idx, pitch in zip(note_indices, pitches):
         cells[note_idx] = pitch
 
-    cell_duration = Duration(quarterLength=4/grid.value)
-    melody_objects = []
-    for cell in cells:
-        if cell:
-            melody_objects.append(Note(pitch=cell, duration=cell_duration))
-        else:
-            melody_objects.append(Rest(duration=cell_duration))
+    return MelodyData([p.midi if p else -1 for p in cells], grid, seed)
+
+
+def _iter_bar_seeds(seed: int) -> Iterator[int]:
+    """
+    Independent 64-bit seeds for bars 0, 1, 2... of a refresh, bar i gets the same seed however many bars there are
+    """
+    for bar_idx in itertools.count():
+        digest = hashlib.blake2b(f"{seed}:{bar_idx}".encode(), digest_size=8).digest()
+        yield int.from_bytes(digest, "big")
+
+
+def _get_render_key(params: Service.Params, melodies_data: list[MelodyData], rhythm_schemes: list[RhythmScheme]) -> str:
+    """
+    Content hash of everything rendered MIDI depends on.
+    Scale and chords are covered by the notes and rhythm schemes they produced
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((params.midi_backend.value, TEMPO, MELODY_VELOCITY, RHYTHM_VELOCITY)).encode())
+    for melody_data, rhythm_scheme in zip(melodies_data, rhythm_schemes):
+        h.update(repr((melody_data.grid.value, rhythm_scheme)).encode())
+        h.update(melody_data.notes.tobytes())
+    return h.hexdigest()
+
+
+# Triad name -> pitch_set indices of its tones
+ChordToneIndex = dict[str, tuple[int, ...]]
+
+
+def _build_chord_tone_index(pitch_set: list[Pitch]) -> ChordToneIndex:
+    """
+    Chord tones of all 24 triads in the scale, pitches are matched by pitch class bitmask
+    """
+    pitch_bits = [1 << p.pitchClass for p in pitch_set]
+    index = {}
+    for name in MAJOR_CHORDS + MINOR_CHORDS:
+        chord_mask = sum(1 << pc for pc in Triad(name).pitch_classes)
+        index[name] = tuple(i for i, bit in enumerate(pitch_bits) if bit & chord_mask)
+    return index
+
+
+class MelodyModel:
+    """
+    Alias tables of the weighted engine for one scale.
+    Row i gives the pitch after pitch i, row len(model) gives the first pitch of a bar.
+    Chord tables have the same rows restricted to chord tones after those
+    """
+
+    def __init__(self, pitch_set: list[Pitch], chord_tone_index: ChordToneIndex, config: dict) -> None:
+
+        n = len(pitch_set)
+        degrees = config.get("degrees") or [1]
+        intervals = config.get("intervals") or [1]
+        contour = float(config.get("contour", 0))
+
+        degree_weights = np.array([degrees[i % len(degrees)] for i in range(n)], dtype=np.float64)
+        steps = np.arange(n)[np.newaxis] - np.arange(n)[:, np.newaxis]  # [from, to]
+        interval_weights = np.array(list(intervals) + [0] * n, dtype=np.float64)[np.abs(steps)]
+        contour_weights = np.where(steps > 0, 1 + contour, np.where(steps < 0, 1 - contour, 1)).clip(0)
+
+        self._chord_tone_index = chord_tone_index
+        self._pitch_midi = [p.midi for p in pitch_set]
+        self._weights = np.vstack([degree_weights * interval_weights * contour_weights, degree_weights])
+        self._table = AliasTable(self._weights)
+        self._chord_tables: dict[str, Optional[AliasTable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pitch_midi)
+
+    @property
+    def pitch_midi(self) -> list[int]:
+        return self._pitch_midi
+
+    @property
+    def table(self) -> AliasTable:
+        return self._table
+
+    def chord_table(self, chord: Triad) -> Optional[AliasTable]:
+        """
+        Rows of table followed by rows restricted to chord tones, None if the scale has none of them
+        """
+
+        if chord.name in self._chord_tables:
+            return self._chord_tables[chord.name]
+
+        mask = np.zeros(len(self), dtype=np.float64)
+        mask[list(self._chord_tone_index[chord.name])] = 1
+
+        table = None
+        if mask.any():
+            weights = self._weights * mask
+            # From pitches with no weighted step to a chord tone go by degree weights only
+            unreachable = weights.sum(axis=1) <= 0
+            weights[unreachable] = self._weights[-1] * mask
+            unreachable = weights.sum(axis=1) <= 0
+            weights[unreachable] = mask
+            table = AliasTable(np.vstack([self._weights, weights]))
+
+        self._chord_tables[chord.name] = table
+        return table
+
+
+def _get_weighted_melody(
+        model: MelodyModel,
+        note_count: int,
+        grid: Grid,
+        chord: Optional[Triad] = None,
+        chord_tones_threshold: Optional[float] = 1.0,
+        seed: Optional[int] = None
+) -> MelodyData:
+    """
+    _get_random_melody with pitches walked through the alias tables of the model
+    """
+
+    rng = random.Random(seed)
+
+    if not len(model) or note_count < 1:
+        return MelodyData([-1] * grid.value, grid, seed)
+
+    note_count = min([note_count, grid.value])
+    note_indices = rng.sample(range(grid.value), k=note_count)
+    note_indices.sort()
+
+    # Row offsets into the table, chord tones are sampled from the second half of the chord table
+    table = model.chord_table(chord) if chord else None
+    if table is None:
+        table = model.table
+        offsets = [0] * note_count
+    else:
+        chord_note_count = math.ceil(note_count * chord_tones_threshold)
+        offsets = [len(model) + 1] * chord_note_count + [0] * (note_count - chord_note_count)
+        rng.shuffle(offsets)
+
+    cells = [-1] * grid.value
+    pitch_idx = len(model)
+    for note_idx, offset in zip(note_indices, offsets):
+        pitch_idx = table.sample(pitch_idx + offset, rng.random())
+        cells[note_idx] = model.pitch_midi[pitch_idx]
+
+    return MelodyData(cells, grid, seed)
+
+
+def _get_random_indices(
+        rng: np.random.Generator,
+        n: int,
+        pitch_count: int,
+        note_count: int,
+        grid: Grid,
+        chord_tone_indices: Optional[list[int]] = None,
+        chord_tones_threshold: Optional[float] = 1.0
+) -> np.ndarray:
+    """
+    Vectorized _get_random_melody for n bars at once.
+    Returns (n, grid) array of pitch_set indices, -1 is a rest
+    """
+
+    result = np.full((n, grid.value), -1, dtype=np.int16)
+
+    if not pitch_count or note_count < 1 or n < 1:
+        return result
+
+    note_count = min([note_count, grid.value])
+
+    note_indices = np.argsort(rng.random((n, grid.value)), axis=1)[:, :note_count]
+
+    if not chord_tone_indices:
+        pitches = rng.integers(0, pitch_count, size=(n, note_count))
+    else:
+        chord_note_count = math.ceil(note_count * chord_tones_threshold)
+        any_note_count = note_count - chord_note_count
+        chord_tones = np.asarray(chord_tone_indices)
+        chord_pitches = chord_tones[rng.integers(0, len(chord_tones), size=(n, chord_note_count))]
+        any_pitches = rng.integers(0, pitch_count, size=(n, any_note_count))
+        pitches = np.concatenate([chord_pitches, any_pitches], axis=1)
+        # Shuffle pitches within each bar
+        order = np.argsort(rng.random((n, note_count)), axis=1)
+        pitches = np.take_along_axis(pitches, order, axis=1)
+
+    np.put_along_axis(result, note_indices, pitches, axis=1)
+    return result
 
-    return MelodyData(Melody(melody_objects), cells)
+
+def _get_weighted_indices(
+        rng: np.random.Generator,
+        n: int,
+        model: MelodyModel,
+        note_count: int,
+        grid: Grid,
+        chord: Optional[Triad] = None,
+        chord_tones_threshold: Optional[float] = 1.0
+) -> np.ndarray:
+    """
+    Vectorized _get_weighted_melody for n bars at once, one step of the walk for all bars at a time
+    """
+
+    result = np.full((n, grid.value), -1, dtype=np.int16)
+
+    if not len(model) or note_count < 1 or n < 1:
+        return result
+
+    note_count = min([note_count, grid.value])
+
+    note_indices = np.sort(np.argsort(rng.random((n, grid.value)), axis=1)[:, :note_count], axis=1)
+
+    table = model.chord_table(chord) if chord else None
+    if table is None:
+        table = model.table
+        offsets = np.zeros((n, note_count), dtype=np.int64)
+    else:
+        chord_note_count = math.ceil(note_count * chord_tones_threshold)
+        is_chord_tone = np.argsort(rng.random((n, note_count)), axis=1) < chord_note_count
+        offsets = is_chord_tone * (len(model) + 1)
+
+    u = rng.random((n, note_count))
+    pitches = np.empty((n, note_count), dtype=np.int64)
+    pitch_idx = np.full(n, len(model), dtype=np.int64)
+    for step in range(note_count):
+        pitches[:, step] = pitch_idx = table.sample_many(pitch_idx + offsets[:, step], u[:, step])
+
+    np.put_along_axis(result, note_indices, pitches, axis=1)
+    return result
+
+
+_scale_pitches: dict[str, list[Pitch]] = {}
 
 
-@lru_cache(maxsize=None)
 def _get_scale_pitches(scale_name: str) -> list[Pitch]:
-    scales = SCALES_YML.read()
-    if not scales:
-        return []
-    return [Pitch(p) for p in scales.get(scale_name, [])]
+    _sync_library(LibraryKind.SCALES)
+    if scale_name not in _scale_pitches:
+        scale = LIBRARY.get(LibraryKind.SCALES.value, scale_name)
+        if isinstance(scale, dict):
+            scale = scale.get("pitches")
+        from music21.pitch import Pitch
+        _scale_pitches[scale_name] = [Pitch(p) for p in scale or []]
+    return _scale_pitches[scale_name]
 
 
-@lru_cache(maxsize=None)
-def _get_rhythm_stream(rhythm_name: str, chord: Triad) -> Stream:
+_scale_note_names: dict[str, dict[int, str]] = {}
+
+
+def _get_scale_note_names(scale_name: str) -> dict[int, str]:
+    if scale_name not in _scale_note_names:
+        _scale_note_names[scale_name] = {p.midi: p.name for p in _get_scale_pitches(scale_name)}
+    return _scale_note_names[scale_name]
+
+
+_chord_tone_indices: dict[str, ChordToneIndex] = {}
+
+
+def _get_chord_tone_index(scale_name: str) -> ChordToneIndex:
+    if scale_name not in _chord_tone_indices:
+        _chord_tone_indices[scale_name] = _build_chord_tone_index(_get_scale_pitches(scale_name))
+    return _chord_tone_indices[scale_name]
+
+
+def _on_scales_change(scale_names: set[str]) -> None:
+    for scale_name in scale_names:
+        _scale_pitches.pop(scale_name, None)
+        _scale_note_names.pop(scale_name, None)
+        _chord_tone_indices.pop(scale_name, None)
+        _melody_models.pop(scale_name, None)
+    if scale_names:
+        PREFETCHER.invalidate()
+
+
+_melody_models: dict[str, MelodyModel] = {}
+
+
+def _get_melody_model(scale_name: str) -> MelodyModel:
+    if scale_name not in _melody_models:
+        weights = WEIGHTS_YML.read() or {}
+        config = weights.get(scale_name) or weights.get("default") or {}
+        _melody_models[scale_name] = MelodyModel(
+            _get_scale_pitches(scale_name), _get_chord_tone_index(scale_name), config
+        )
+    return _melody_models[scale_name]
 
+
+def _on_weights_change(scale_names: set[str]) -> None:
+    if "default" in scale_names:
+        _melody_models.clear()
+    for scale_name in scale_names:
+        _melody_models.pop(scale_name, None)
+    if scale_names:
+        PREFETCHER.invalidate()
+
+
+def _get_bar_generator(params: Service.Params) -> Callable[[Optional[Triad], int], MelodyData]:
+    """
+    Generates a bar over the chord from the seed with the settings of params, scale lookups are done once
+    """
+
+    with LATENCY.span("service.scale_lookup"):
+        scale_pitches = _get_scale_pitches(params.scale_name)
+        chord_tone_index = _get_chord_tone_index(params.scale_name)
+        model = _get_melody_model(params.scale_name) if params.melody_engine == MelodyEngine.WEIGHTED else None
+
+    def generate_bar(chord: Optional[Triad], seed: int) -> MelodyData:
+        if model is not None:
+            return _get_weighted_melody(
+                model=model,
+                note_count=params.note_count,
+                grid=params.grid,
+                chord=chord,
+                chord_tones_threshold=params.chord_tones_threshold,
+                seed=seed
+            )
+        return _get_random_melody(
+            pitch_set=scale_pitches,
+            note_count=params.note_count,
+            grid=params.grid,
+            chord_tone_indices=chord_tone_index[chord.name] if chord else None,
+            chord_tones_threshold=params.chord_tones_threshold,
+            seed=seed
+        )
+
+    return generate_bar
+
+
+class RhythmTemplate(NamedTuple):
+    masks: dict[str, int]  # Degree -> bitmask of 16th steps
+    major: RhythmScheme  # Semitones from the root on each 16th step
+    minor: RhythmScheme
+
+
+def _compile_rhythm(scheme: dict) -> RhythmTemplate:
+
+    masks = {}
+    for degree in RHYTHM_DEGREES:
+        line = scheme.get(degree, "")[:16]
+        masks[degree] = sum(1 << i for i, c in enumerate(line) if c != "-")
+
+    def intervals(mode: int) -> RhythmScheme:
+        return tuple(
+            tuple(offsets[mode] for degree, offsets in RHYTHM_DEGREES.items() if masks[degree] >> i & 1)
+            for i in range(16)
+        )
+
+    return RhythmTemplate(masks, intervals(0), intervals(1))
+
+
+_rhythm_templates: dict[str, Optional[RhythmTemplate]] = {}
+
+# (rhythm name, triad name) -> music21 stream of a bar, least recently used streams are evicted
+RHYTHM_STREAMS_CACHE_SIZE = 128
+_rhythm_streams: OrderedDict[tuple[str, Optional[str]], Stream] = OrderedDict()
+
+# Rhythm caches are filled outside the lock, a value read from LIBRARY before a change
+# is dropped instead of cached if _rhythm_generation moved on meanwhile
+_rhythm_lock = threading.Lock()
+_rhythm_generation = 0
+
+
+def _get_rhythm_template(rhythm_name: str) -> Optional[RhythmTemplate]:
+
+    _sync_library(LibraryKind.RHYTHMS)
+    with _rhythm_lock:
+        if rhythm_name in _rhythm_templates:
+            return _rhythm_templates[rhythm_name]
+        generation = _rhythm_generation
+
+    definition = LIBRARY.get(LibraryKind.RHYTHMS.value, rhythm_name) if rhythm_name else None
+    template = _compile_rhythm(definition) if definition else None
+
+    with _rhythm_lock:
+        if generation == _rhythm_generation:
+            _rhythm_templates[rhythm_name] = template
+    return template
+
+
+def _on_rhythms_change(rhythm_names: set[str]) -> None:
+    global _rhythm_generation
+    with _rhythm_lock:
+        _rhythm_generation += 1
+        for rhythm_name in rhythm_names:
+            _rhythm_templates.pop(rhythm_name, None)
+            _rhythm_chunks.pop(rhythm_name, None)
+        for key in [k for k in _rhythm_streams if k[0] in rhythm_names]:
+            _rhythm_streams.pop(key, None)
+    if rhythm_names:
+        PREFETCHER.invalidate()
+
+
+def _get_rhythm_scheme(rhythm_name: str, chord: Triad) -> RhythmScheme:
+    """
+    MIDI note numbers sounding on each 16th step of the bar
+    """
     if not chord:
-        return Stream([Rest(duration=Duration(quarterLength=4))])
-
-    rhythm = RHYTHMS_YML.read()
-
-    if not rhythm:
-        return Stream([Rest(duration=Duration(quarterLength=4))])
-    scheme = rhythm.get(rhythm_name)
-    if not scheme:
-        return Stream([Rest(duration=Duration(quarterLength=4))])
-
-    result = Stream()
-
-    root_pitches = {
-        "A": "A2",
-        "A#": "A#2",
-        "B": "B2",
-        "C": "C3",
-        "C#": "C3",
-        "D": "D3",
-        "D#": "D#2",
-        "E": "E2",
-        "F": "F2",
-        "F#": "F#2",
-        "G": "G2",
-        "G#": "G#2"
+        return EMPTY_RHYTHM_SCHEME
+    return _transpose_rhythm(_get_rhythm_template(rhythm_name), chord)
+
+
+def _transpose_rhythm(template: Optional[RhythmTemplate], chord: Triad) -> RhythmScheme:
+
+    if not template:
+        return EMPTY_RHYTHM_SCHEME
+
+    root = RHYTHM_ROOTS[chord.tonic_name]
+    intervals = template.major if chord.is_major else template.minor
+    return tuple(tuple(root + i for i in step) for step in intervals)
+
+
+# Rhythm name -> triad name -> encoded rhythm track of a bar, least recently used rhythms are evicted
+RHYTHM_CHUNKS_CACHE_SIZE = 64
+_rhythm_chunks: OrderedDict[str, dict[str, EncodedChunk]] = OrderedDict()
+
+
+def _get_rhythm_chunk(rhythm_name: Optional[str], chord: Optional[Triad]) -> EncodedChunk:
+
+    if not chord or not rhythm_name:
+        return EMPTY_RHYTHM_CHUNK
+
+    _sync_library(LibraryKind.RHYTHMS)
+    with _rhythm_lock:
+        chunks = _rhythm_chunks.get(rhythm_name)
+        if chunks is not None:
+            _rhythm_chunks.move_to_end(rhythm_name)
+            return chunks[chord.name]
+        generation = _rhythm_generation
+
+    chunks = _load_rhythm_chunks(LIBRARY.get(LibraryKind.RHYTHMS.value, rhythm_name))
+
+    with _rhythm_lock:
+        if generation == _rhythm_generation:
+            _rhythm_chunks[rhythm_name] = chunks
+            while len(_rhythm_chunks) > RHYTHM_CHUNKS_CACHE_SIZE:
+                _rhythm_chunks.popitem(last=False)
+    return chunks[chord.name]
+
+
+def _get_rhythm_chunks_path(definition: Optional[dict]) -> Path:
+    """
+    File of the encoded chunks named by the hash of the rhythm definition and everything else they depend on
+    """
+    key = {
+        "rhythm": definition,
+        "degrees": RHYTHM_DEGREES,
+        "roots": RHYTHM_ROOTS,
+        "velocity": RHYTHM_VELOCITY,
+        "ticks_per_quarter": TICKS_PER_QUARTER
     }
-    pitch_i = Pitch(root_pitches[chord.name if chord.is_major else chord.name[:-1]])
-    pitch_iii = pitch_i.transpose(4 if chord.is_major else 3)
-    pitch_v = pitch_i.transpose(7)
-    pitch_I = pitch_i.transpose(12)
-    pitch_III = pitch_I.transpose(4 if chord.is_major else 3)
-    pitch_5 = pitch_i.transpose(-5)
-
-    duration = Duration(quarterLength=0.25)
-    for i in range(16):
-        chord_notes = []
-        if scheme["5"][i] != "-":
-            note = Note(pitch_5, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-        if scheme["i"][i] != "-":
-            note = Note(pitch_i, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-        if scheme["iii"][i] != "-":
-            note = Note(pitch_iii, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-        if scheme["v"][i] != "-":
-            note = Note(pitch_v, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-        if scheme["I"][i] != "-":
-            note = Note(pitch_I, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-        if scheme["III"][i] != "-":
-            note = Note(pitch_III, duration=duration)
-            note.volume.velocity = 48
-            chord_notes.append(note)
-
-        if chord_notes:
-            result.append(Chord(chord_notes))
-        else:
-            result.append(Rest(duration=duration))
+    digest = hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=16).hexdigest()
+    return RHYTHM_CACHE_FOLDER.path / f"{digest}.bin"
+
+
+def _load_rhythm_chunks(definition: Optional[dict]) -> dict[str, EncodedChunk]:
+    """
+    Encoded bars of the rhythm for all 24 triads from RHYTHM_CACHE_FOLDER, they are encoded and saved
+    if the file is missing or damaged. The file name and the chunks come from the same definition
+    """
+
+    path = _get_rhythm_chunks_path(definition)
+    try:
+        return _read_rhythm_chunks(path)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    chunks = _encode_rhythm_chunks(definition)
+    _write_rhythm_chunks(path, chunks)
+    return chunks
+
+
+def _encode_rhythm_chunks(definition: Optional[dict]) -> dict[str, EncodedChunk]:
+    template = _compile_rhythm(definition) if definition else None
+    chunks = {}
+    for chord_name in MAJOR_CHORDS + MINOR_CHORDS:
+        _, rhythm_events = _get_note_events([], [_transpose_rhythm(template, Triad(chord_name))])
+        chunks[chord_name] = encode_chunk(rhythm_events, 4, TICKS_PER_QUARTER)
+    return chunks
+
+
+def _read_rhythm_chunks(path: Path) -> dict[str, EncodedChunk]:
+    data = path.read_bytes()
+    chunks, offset = {}, 0
+    for chord_name in MAJOR_CHORDS + MINOR_CHORDS:
+        chunks[chord_name], offset = EncodedChunk.from_bytes(data, offset)
+    if offset != len(data):
+        raise ValueError(f"{path.name} has {len(data) - offset} bytes after the last chunk")
+    return chunks
+
+
+def _write_rhythm_chunks(path: Path, chunks: dict[str, EncodedChunk]) -> None:
+    RHYTHM_CACHE_FOLDER.create()
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(b"".join(chunks[chord_name].to_bytes() for chord_name in MAJOR_CHORDS + MINOR_CHORDS))
+    os.replace(tmp_path, path)
+
+
+def _warm_rhythm_chunks_in_background() -> None:
+    """
+    Encodes chunk files missing for rhythms in the library and removes files of rhythms that are gone or changed.
+    Chunks are loaded into memory only when a rhythm is played
+    """
+
+    def warm() -> None:
+        try:
+            RHYTHM_CACHE_FOLDER.create()
+            paths = set()
+            for rhythm_name in LIBRARY.names(LibraryKind.RHYTHMS.value):
+                definition = LIBRARY.get(LibraryKind.RHYTHMS.value, rhythm_name)
+                path = _get_rhythm_chunks_path(definition)
+                paths.add(path)
+                if not path.exists():
+                    _write_rhythm_chunks(path, _encode_rhythm_chunks(definition))
+            for path in RHYTHM_CACHE_FOLDER.find_by_suffix(".bin"):
+                if path not in paths:
+                    path.unlink(missing_ok=True)
+        except Exception:
+            logger.exception("Rhythm cache warm-up failed")
+
+    threading.Thread(target=warm, daemon=True).start()
+
+
+def _get_rhythm_stream(rhythm_name: str, chord: Triad) -> Stream:
+
+    key = (rhythm_name, chord.name if chord else None)
+    _sync_library(LibraryKind.RHYTHMS)
+    with _rhythm_lock:
+        stream = _rhythm_streams.get(key)
+        if stream is not None:
+            _rhythm_streams.move_to_end(key)
+            return stream
+        generation = _rhythm_generation
+
+    from src.notation import rhythm_stream
+    stream = rhythm_stream(_get_rhythm_scheme(rhythm_name, chord), RHYTHM_VELOCITY)
+
+    with _rhythm_lock:
+        if generation == _rhythm_generation:
+            _rhythm_streams[key] = stream
+            while len(_rhythm_streams) > RHYTHM_STREAMS_CACHE_SIZE:
+                _rhythm_streams.popitem(last=False)
+    return stream
+
+
+def _get_note_events(
+        melodies_data: list[MelodyData],
+        rhythm_schemes: list[RhythmScheme],
+        offset: float = 0
+) -> tuple[list[NoteEvent], list[NoteEvent]]:
+
+    melody_events = []
+    for bar_idx, melody_data in enumerate(melodies_data):
+        cell_duration = 4 / melody_data.grid.value
+        for cell_idx, note in enumerate(melody_data.notes):
+            if note >= 0:
+                melody_events.append(NoteEvent(
+                    offset=offset + bar_idx * 4 + cell_idx * cell_duration,
+                    duration=cell_duration,
+                    pitch=note,
+                    velocity=MELODY_VELOCITY
+                ))
+
+    rhythm_events = []
+    for bar_idx, rhythm_scheme in enumerate(rhythm_schemes):
+        for step_idx, pitches in enumerate(rhythm_scheme):
+            for pitch in pitches:
+                rhythm_events.append(NoteEvent(
+                    offset=offset + bar_idx * 4 + step_idx * 0.25,
+                    duration=0.25,
+                    pitch=pitch,
+                    velocity=RHYTHM_VELOCITY
+                ))
+
+    return melody_events, rhythm_events
+
+
+def _render_midi_native(melodies_data: list[MelodyData], rhythm_chunks: list[EncodedChunk]) -> bytes:
+    with LATENCY.span("service.sum"):
+        melody_events, _ = _get_note_events(melodies_data, [])
+    with LATENCY.span("service.midi_write"):
+        midi_file = MidiFile(tempo=TEMPO, ticks_per_quarter=TICKS_PER_QUARTER)
+        midi_file.add_track(melody_events)
+        midi_file.add_encoded_track(join_chunks(rhythm_chunks))
+        return midi_file.to_bytes()
+
+
+def _render_midi_music21(melodies_data: list[MelodyData], rhythm_streams: list[Stream]) -> bytes:
+    from src.notation import render_midi
+    return render_midi([md.melody for md in melodies_data], rhythm_streams)
+
+
+class MelodyBatch:
+    """
+    N variations of the bars stored as (n, bars, grid) array of pitch_set indices, -1 is a rest.
+    MelodyData and MIDI are built only for the requested variations
+    """
+
+    __slots__ = ("_indices", "_pitch_midi", "_grid", "_bars_data", "_rhythm_chunks")
+
+    def __init__(
+            self,
+            indices: np.ndarray,
+            pitch_set: list[Pitch],
+            bars_data: list[Optional[MelodyData]],
+            rhythm_chunks: list[EncodedChunk]
+    ) -> None:
+        self._indices = indices
+        self._pitch_midi = np.array([p.midi for p in pitch_set], dtype=np.int8)
+        self._grid = Grid(indices.shape[-1])
+        self._bars_data = bars_data  # MelodyData of inactive bars, None for active ones
+        self._rhythm_chunks = rhythm_chunks
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    @property
+    def indices(self) -> np.ndarray:
+        return self._indices
+
+    @property
+    def mask(self) -> np.ndarray:
+        return self._indices >= 0
+
+    def melody_data(self, idx: int) -> list[MelodyData]:
+        result = []
+        for bar_indices, bar_data in zip(self._indices[idx], self._bars_data):
+            if bar_data is not None:
+                result.append(bar_data)
+            elif not len(self._pitch_midi):
+                result.append(MelodyData.empty(self._grid))  # No pitches to index, all cells are rests
+            else:
+                notes = np.where(bar_indices >= 0, self._pitch_midi[bar_indices], -1)
+                result.append(MelodyData(notes.tolist(), self._grid))
+        return result
+
+    def midi(self, idx: int) -> bytes:
+        return _render_midi_native(self.melody_data(idx), self._rhythm_chunks)
+
+    def save_midi(self, idx: int, path: PathLike) -> None:
+        with open(path, "wb") as file:
+            file.write(self.midi(idx))
+
+
+# YAML files synced into LIBRARY and callbacks for the names of changed entries
+_LIBRARY_SOURCES = {
+    LibraryKind.SCALES: (SCALES_YML, _on_scales_change),
+    LibraryKind.RHYTHMS: (RHYTHMS_YML, _on_rhythms_change)
+}
+_library_signatures: dict[LibraryKind, str] = {}
+_library_lock = threading.RLock()
+
+
+def _sync_library(kind: LibraryKind) -> None:
+    """
+    Imports the YAML file of the kind into LIBRARY if it changed since the last import.
+    Otherwise it costs a stat call, or a stat call and a query on the first call
+    """
+
+    yaml_file, on_change = _LIBRARY_SOURCES[kind]
+    signature = _get_file_signature(yaml_file.path)
+    if signature is None or signature == _library_signatures.get(kind):
+        return
+
+    with _library_lock:
+        if signature == _library_signatures.get(kind):
+            return
+        if LIBRARY.signature(kind.value, yaml_file.path.name) != signature:
+            data = yaml_file.read()
+            if signature == _library_signatures.get(kind):
+                return  # Synced by a listener of the read
+            changed = LIBRARY.import_entries(kind.value, yaml_file.path.name, data or {}, signature)
+            on_change(changed)
+        _library_signatures[kind] = signature
+
+
+def _get_file_signature(path: Path) -> Optional[str]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+SCALES_YML.subscribe(lambda _: _sync_library(LibraryKind.SCALES))
+RHYTHMS_YML.subscribe(lambda _: _sync_library(LibraryKind.RHYTHMS))
+WEIGHTS_YML.subscribe(_on_weights_change)
+
+
+def _get_last_midi_number() -> int:
+    numbers = [int(p.stem) for p in MIDI_FOLDER.find_by_suffix(".mid") if p.stem.isdigit()]
+    return max(numbers, default=0)
+
+
+_midi_retention_lock = threading.Lock()
+
+
+_sequencer: Optional[Sequencer] = None
+_sequencer_error: Optional[str] = None
+_sequencer_lock = threading.Lock()
+
+
+def _get_sequencer() -> Optional[Sequencer]:
+    """
+    Sequencer playing to MIDI_OUT_PORT, None if the port can't be opened
+    """
+
+    global _sequencer, _sequencer_error
+
+    with _sequencer_lock:
+        if _sequencer is None and _sequencer_error is None:
+            try:
+                sink = RtMidiSink(MIDI_OUT_PORT)
+            except Exception as e:
+                _sequencer_error = str(e)
+                logger.warning(f"Built-in playback is unavailable: {e}")
+            else:
+                _sequencer = Sequencer(sink)
+                logger.info(f"Playing to MIDI output {sink.name}")
+        return _sequencer
 
-    return result
+
+def _apply_midi_retention_in_background() -> None:
+
+    if not _midi_retention_lock.acquire(blocking=False):
+        return
+
+    def apply() -> None:
+        try:
+            MIDI_RETENTION.apply(MIDI_FOLDER, ".mid")
+        finally:
+            _midi_retention_lock.release()
+
+    threading.Thread(target=apply, daemon=True).start()
 
 
 class Service:
@@ -256,58 +1004,583 @@ class Service:
         grid: Grid
         chord_tones_threshold: float
         rhythm_name: Optional[str] = None
+        midi_backend: MidiBackend = MidiBackend.NATIVE
+        melody_engine: MelodyEngine = MelodyEngine.UNIFORM
+        seed: Optional[int] = None  # Random seed of the refresh when None
+
+        def key(self) -> tuple:
+            """
+            Everything the output depends on, melody data counts only for inactive bars
+            """
+            return (
+                self.scale_name,
+                self.note_count,
+                self.grid,
+                self.chord_tones_threshold,
+                self.rhythm_name,
+                self.midi_backend,
+                self.melody_engine,
+                self.seed,
+                tuple(
+                    (
+                        bar.chord.name if bar.chord else None,
+                        bar.active,
+                        None if bar.active else bar.melody_data.notes.tobytes()
+                    )
+                    for bar in self.bars
+                )
+            )
 
     @staticmethod
-    def process_four_bars(params: Params) -> list[MelodyData]:
+    def init_app_dir(background_tasks: bool = True) -> None:
+        """
+        Creates app folder and default configs, scales and rhythms are synced into LIBRARY.
+        With background_tasks configs are watched, MIDI retention is applied,
+        encoded rhythms are cached and the MIDI output is opened in background
+        """
+
+        MIDI_FOLDER.create()
+
+        for yaml_file, default in [
+            (SCALES_YML, DEFAULT_SCALES), (RHYTHMS_YML, DEFAULT_RHYTHMS), (WEIGHTS_YML, DEFAULT_WEIGHTS)
+        ]:
+            if not yaml_file.exists() or not yaml_file.path.stat().st_size:
+                yaml_file.write(default)
+            if background_tasks:
+                yaml_file.watch()
+
+        for kind in LibraryKind:
+            _sync_library(kind)
+
+        if background_tasks:
+            _apply_midi_retention_in_background()
+            _warm_rhythm_chunks_in_background()
+            threading.Thread(target=_get_sequencer, daemon=True).start()
+            if RENDER_CACHE.folder is not None:
+                threading.Thread(
+                    target=RENDER_CACHE_RETENTION.apply, args=(RENDER_CACHE.folder, ".mid"), daemon=True
+                ).start()
+
+    @staticmethod
+    def preload() -> None:
+        """
+        Imports music21 ahead of the first refresh
+        """
+        import src.notation  # noqa: F401
+
+    @staticmethod
+    def generate(params: Params) -> list[MelodyData]:
+        """
+        Melody data of every bar, generated ones hold the seed they can be reproduced with
+        """
+
+        generate_bar = _get_bar_generator(params)
+        seed = params.seed if params.seed is not None else random.getrandbits(64)
+
+        with LATENCY.span("service.melody_generation"):
+            melodies_data = []
+            for bar, bar_seed in zip(params.bars, _iter_bar_seeds(seed)):
+                if not bar.active:
+                    melodies_data.append(bar.melody_data)
+                else:
+                    melodies_data.append(generate_bar(bar.chord, bar_seed))
+
+        return melodies_data
+
+    @staticmethod
+    def stream_bars(
+            params: Params,
+            chords: Iterable[Optional[Triad]]
+    ) -> Iterator[tuple[Optional[Triad], MelodyData]]:
+        """
+        Lazily generates a bar for each chord with the settings of params, params.bars are not used.
+        Bar i is the same as bar i of generate with the same seed and chord
+        """
+
+        generate_bar = _get_bar_generator(params)
+        seed = params.seed if params.seed is not None else random.getrandbits(64)
+
+        for chord, bar_seed in zip(chords, _iter_bar_seeds(seed)):
+            yield chord, generate_bar(chord, bar_seed)
+
+    @staticmethod
+    def write_midi_stream(params: Params, chords: Iterable[Optional[Triad]], file: BinaryIO) -> int:
+        """
+        Writes a bar for each chord to a seekable binary file as it is generated,
+        memory use does not depend on the number of bars. Always uses the native MIDI writer.
+        Returns the number of bars written
+        """
+
+        bar_count = 0
+        with MidiStreamWriter(file, tempo=TEMPO) as writer:
+            for chord, melody_data in Service.stream_bars(params, chords):
+                rhythm_scheme = _get_rhythm_scheme(params.rhythm_name, chord)
+                melody_events, rhythm_events = _get_note_events([melody_data], [rhythm_scheme], bar_count * 4)
+                writer.write(melody_events + rhythm_events)
+                bar_count += 1
+
+        return bar_count
+
+    @staticmethod
+    def render_midi(params: Params, melodies_data: list[MelodyData]) -> bytes:
+        """
+        Standard MIDI File content, looked up in RENDER_CACHE by content hash first
+        """
+
+        with LATENCY.span("service.rhythm_build"):
+            rhythm_schemes = [_get_rhythm_scheme(params.rhythm_name, bar.chord) for bar in params.bars]
+
+        with LATENCY.span("service.render_cache"):
+            key = _get_render_key(params, melodies_data, rhythm_schemes)
+            data = RENDER_CACHE.get(key)
+        if data is not None:
+            return data
+
+        if params.midi_backend == MidiBackend.NATIVE:
+            with LATENCY.span("service.rhythm_build"):
+                rhythm_chunks = [_get_rhythm_chunk(params.rhythm_name, bar.chord) for bar in params.bars]
+            data = _render_midi_native(melodies_data, rhythm_chunks)
+        else:
+            with LATENCY.span("service.rhythm_build"):
+                rhythm_streams = [_get_rhythm_stream(params.rhythm_name, bar.chord) for bar in params.bars]
+            data = _render_midi_music21(melodies_data, rhythm_streams)
+
+        RENDER_CACHE.put(key, data)
+        return data
+
+    @staticmethod
+    def save_midi(data: bytes) -> Path:
+        """
+        Writes MIDI file content to the next numbered file in MIDI_FOLDER,
+        every MIDI_RETENTION_INTERVAL files retention is applied in background
+        """
+
+        with LATENCY.span("service.midi_save"):
+            number = MIDI_SEQUENCE.next()
+            filepath = MIDI_FOLDER.path / f"{number}.mid"
+            with open(filepath, "wb") as file:
+                file.write(data)
+        if number % MIDI_RETENTION_INTERVAL == 0:
+            _apply_midi_retention_in_background()
+        return filepath
+
+    @staticmethod
+    def process_four_bars(params: Params, cancel_token: Optional[CancelToken] = None) -> list[MelodyData]:
+
+        prefetched = PREFETCHER.take(params)
+        if prefetched:
+            melodies_data, data = prefetched
+        else:
+            melodies_data = Service.generate(params)
+
+            if cancel_token:
+                cancel_token.check()
+
+            data = Service.render_midi(params, melodies_data)
+
+        if cancel_token:
+            cancel_token.check()
+
+        Service._save_and_play(data)
+
+        HISTORY.push(params, melodies_data)
+        PREFETCHER.schedule(params)
+
+        return melodies_data
+
+    @staticmethod
+    def undo(cancel_token: Optional[CancelToken] = None) -> Optional[Params]:
+        """
+        Replays the previous generation, bars of the returned params hold its melody data
+        """
+        return Service._replay(-1, cancel_token)
+
+    @staticmethod
+    def redo(cancel_token: Optional[CancelToken] = None) -> Optional[Params]:
+        return Service._replay(1, cancel_token)
+
+    @staticmethod
+    def can_undo() -> bool:
+        return HISTORY.can_undo
+
+    @staticmethod
+    def can_redo() -> bool:
+        return HISTORY.can_redo
+
+    @staticmethod
+    def _replay(step: int, cancel_token: Optional[CancelToken]) -> Optional[Params]:
+        """
+        The history cursor moves only if the replay wasn't cancelled
+        """
+
+        entry = HISTORY.peek(step)
+        if entry is None:
+            return None
+        idx, params = entry
+
+        data = Service.render_midi(params, [bar.melody_data for bar in params.bars])
+
+        if cancel_token:
+            cancel_token.check()
+
+        HISTORY.seek(idx)
+        Service._save_and_play(data)
+        return params
+
+    @staticmethod
+    def _save_and_play(data: bytes) -> None:
+        """
+        Replaces the current playback of the built-in sequencer. If there is no MIDI output,
+        the saved file is opened in the default player where the OS can do it
+        """
+
+        filepath = Service.save_midi(data)
+
+        sequencer = _get_sequencer()
+        if sequencer is None:
+            if not hasattr(os, "startfile"):
+                logger.warning(f"No MIDI output to play {filepath.name}, it is saved to {MIDI_FOLDER.path}")
+                return
+            with LATENCY.span("service.player_launch"):
+                os.startfile(filepath)
+            return
+
+        with LATENCY.span("service.play"):
+            sequencer.play(read_messages(data))
+
+    @staticmethod
+    def set_midi_sink(sink: MidiSink) -> Sequencer:
+        """
+        Plays to sink instead of MIDI_OUT_PORT, e.g. RecordingSink in tests and benchmarks
+        """
+
+        global _sequencer, _sequencer_error
+
+        with _sequencer_lock:
+            if _sequencer is not None:
+                _sequencer.close()
+            _sequencer, _sequencer_error = Sequencer(sink), None
+            return _sequencer
+
+    @staticmethod
+    def stop_playback() -> None:
+        """
+        Releases sounding notes and closes the MIDI output
+        """
+
+        global _sequencer
+
+        with _sequencer_lock:
+            if _sequencer is not None:
+                _sequencer.close()
+                _sequencer = None
+
+    @staticmethod
+    def generate_batch(
+            params: Params,
+            n: int,
+            seed: Union[int, np.random.SeedSequence, None] = None
+    ) -> MelodyBatch:
 
         scale_pitches = _get_scale_pitches(params.scale_name)
+        chord_tone_index = _get_chord_tone_index(params.scale_name)
+        rng = np.random.default_rng(seed)
 
-        melodies_data = []
-        rhythms = []
-        for bar in params.bars:
+        indices = np.full((n, len(params.bars), params.grid.value), -1, dtype=np.int16)
+        bars_data = []
+        rhythm_chunks = []
+        for bar_idx, bar in enumerate(params.bars):
             if not bar.active:
-                melodies_data.append(bar.melody_data)
-            else:
-                melody_data = _get_random_melody(
-                    pitch_set=scale_pitches,
+                bars_data.append(bar.melody_data)
+            elif params.melody_engine == MelodyEngine.WEIGHTED:
+                bars_data.append(None)
+                indices[:, bar_idx] = _get_weighted_indices(
+                    rng=rng,
+                    n=n,
+                    model=_get_melody_model(params.scale_name),
                     note_count=params.note_count,
                     grid=params.grid,
                     chord=bar.chord,
                     chord_tones_threshold=params.chord_tones_threshold
                 )
-                melodies_data.append(melody_data)
-
-            rhythms.append(_get_rhythm_stream(params.rhythm_name, bar.chord))
+            else:
+                bars_data.append(None)
+                indices[:, bar_idx] = _get_random_indices(
+                    rng=rng,
+                    n=n,
+                    pitch_count=len(scale_pitches),
+                    note_count=params.note_count,
+                    grid=params.grid,
+                    chord_tone_indices=chord_tone_index[bar.chord.name] if bar.chord else None,
+                    chord_tones_threshold=params.chord_tones_threshold
+                )
 
-        melody_4 = Melody.sum([md.melody for md in melodies_data])
-        rhythm = Melody.sum([Melody(r) for r in rhythms])
-        stream = Stream()
-        stream.insert(0, melody_4)
-        stream.insert(0, rhythm)
-        filename = str(len(MIDI_FOLDER.files()) + 1) + ".mid"
-        filepath = MIDI_FOLDER.path / filename
-        stream.write("midi", filepath)
-        os.startfile(filepath)
+            rhythm_chunks.append(_get_rhythm_chunk(params.rhythm_name, bar.chord))
 
-        return melodies_data
+        return MelodyBatch(indices, scale_pitches, bars_data, rhythm_chunks)
 
     @staticmethod
     def open_app_folder() -> None:
         os.startfile(APP_DIR)
 
     @staticmethod
-    @lru_cache(maxsize=None)
+    def get_note_names(scale_name: str) -> dict[int, str]:
+        """
+        Names of the scale pitches by MIDI note number, spelled as in the scale
+        """
+        return _get_scale_note_names(scale_name)
+
+    @staticmethod
     def get_scale_names() -> list[str]:
-        scales = SCALES_YML.read()
-        if not scales:
-            return []
-        else:
-            return list(scales.keys())
+        return Service.search_library(LibraryKind.SCALES)
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def get_rhythm_names() -> list[str]:
-        rhythms = RHYTHMS_YML.read()
-        if not rhythms:
-            return []
-        return list(rhythms.keys())
+        return Service.search_library(LibraryKind.RHYTHMS)
+
+    @staticmethod
+    def search_library(
+            kind: LibraryKind,
+            query: str = "",
+            tag: Optional[str] = None,
+            offset: int = 0,
+            limit: Optional[int] = None
+    ) -> list[str]:
+        """
+        Names containing query, case-insensitive, nothing but the names is loaded
+        """
+        _sync_library(kind)
+        return LIBRARY.names(kind.value, query, tag, offset, limit)
+
+    @staticmethod
+    def count_library(kind: LibraryKind, query: str = "", tag: Optional[str] = None) -> int:
+        _sync_library(kind)
+        return LIBRARY.count(kind.value, query, tag)
+
+    @staticmethod
+    def import_library(kind: LibraryKind, path: Union[str, PathLike]) -> set[str]:
+        """
+        Adds entries of a YAML file in the format of scales.yml or rhythms.yml to the library.
+        Importing the same file again replaces its entries. Returns names of changed entries
+        """
+
+        path = Path(path).resolve()
+        _, on_change = _LIBRARY_SOURCES[kind]
+        with _library_lock:
+            changed = LIBRARY.import_entries(kind.value, str(path), YAMLFile(path).read() or {})
+            on_change(changed)
+        return changed
+
+    @staticmethod
+    def export_library(kind: LibraryKind, path: Union[str, PathLike]) -> None:
+        YAMLFile(path).write(LIBRARY.export_entries(kind.value))
+
+
+class HistoryEntry(NamedTuple):
+    scale_name: str
+    note_count: int
+    grid: Grid
+    chord_tones_threshold: float
+    rhythm_name: Optional[str]
+    midi_backend: MidiBackend
+    melody_engine: MelodyEngine
+    bars: tuple[tuple[Optional[str], bool], ...]  # Chord name and active flag of each bar
+    notes: bytes  # Note numbers of all bars one after another
+    seeds: tuple[Optional[int], ...]  # Generation seed of each bar
+
+
+class History:
+    """
+    Generations with undo/redo stored as note numbers and params.
+    The oldest entries are evicted when the approximate size exceeds max_bytes
+    """
+
+    _ENTRY_OVERHEAD = 640  # Approximate size of an entry without notes and strings
+
+    def __init__(self, max_bytes: int = 1024 * 1024) -> None:
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: deque[HistoryEntry] = deque()
+        self._cursor = -1
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def can_undo(self) -> bool:
+        return self._cursor > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self._cursor < len(self._entries) - 1
+
+    def push(self, params: Service.Params, melodies_data: list[MelodyData]) -> None:
+
+        entry = HistoryEntry(
+            scale_name=params.scale_name,
+            note_count=params.note_count,
+            grid=params.grid,
+            chord_tones_threshold=params.chord_tones_threshold,
+            rhythm_name=params.rhythm_name,
+            midi_backend=params.midi_backend,
+            melody_engine=params.melody_engine,
+            bars=tuple((bar.chord.name if bar.chord else None, bar.active) for bar in params.bars),
+            notes=b"".join(md.notes.tobytes() for md in melodies_data),
+            seeds=tuple(md.seed for md in melodies_data)
+        )
+
+        with self._lock:
+            while len(self._entries) - 1 > self._cursor:
+                self._bytes -= self._entry_size(self._entries.pop())
+            self._entries.append(entry)
+            self._bytes += self._entry_size(entry)
+            self._cursor = len(self._entries) - 1
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                self._bytes -= self._entry_size(self._entries.popleft())
+                self._cursor -= 1
+
+    def undo(self) -> Optional[Service.Params]:
+        return self._move(-1)
+
+    def redo(self) -> Optional[Service.Params]:
+        return self._move(1)
+
+    def peek(self, step: int) -> Optional[tuple[int, Service.Params]]:
+        """
+        Index and params of the entry step positions from the cursor, the cursor doesn't move
+        """
+        with self._lock:
+            idx = self._cursor + step
+            if self._cursor < 0 or not 0 <= idx < len(self._entries):
+                return None
+            return idx, self._to_params(self._entries[idx])
+
+    def seek(self, idx: int) -> None:
+        with self._lock:
+            if 0 <= idx < len(self._entries):
+                self._cursor = idx
+
+    def _move(self, step: int) -> Optional[Service.Params]:
+        entry = self.peek(step)
+        if entry is None:
+            return None
+        idx, params = entry
+        self.seek(idx)
+        return params
+
+    def _entry_size(self, entry: HistoryEntry) -> int:
+        strings = [entry.scale_name, entry.rhythm_name or ""] + [chord or "" for chord, _ in entry.bars]
+        return self._ENTRY_OVERHEAD + len(entry.notes) + sum(len(s) for s in strings)
+
+    @staticmethod
+    def _to_params(entry: HistoryEntry) -> Service.Params:
+        n = entry.grid.value
+        return Service.Params(
+            bars=[
+                Service.Params.BarParams(
+                    chord=Triad(chord) if chord else None,
+                    active=active,
+                    melody_data=MelodyData(array("b", entry.notes[i * n:(i + 1) * n]), entry.grid, seed)
+                )
+                for i, ((chord, active), seed) in enumerate(zip(entry.bars, entry.seeds))
+            ],
+            scale_name=entry.scale_name,
+            note_count=entry.note_count,
+            grid=entry.grid,
+            chord_tones_threshold=entry.chord_tones_threshold,
+            rhythm_name=entry.rhythm_name,
+            midi_backend=entry.midi_backend,
+            melody_engine=entry.melody_engine
+        )
+
+
+class Prefetcher:
+    """
+    Generates and renders the next variations in background for the params of the last refresh.
+    Variations are dropped as soon as a refresh comes with different params
+    or scales, rhythms or weights are edited
+    """
+
+    def __init__(self, size: int = 3, max_bytes: int = 1024 * 1024) -> None:
+        self._size = size
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._key: Optional[tuple] = None
+        self._generation = 0
+        self._queue: deque[tuple[list[MelodyData], bytes]] = deque()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "ready": len(self._queue), "bytes": self._bytes}
+
+    def take(self, params: Service.Params) -> Optional[tuple[list[MelodyData], bytes]]:
+
+        key = params.key()
+        with self._lock:
+            if key != self._key:
+                self._reset(key)
+            if self._queue:
+                melodies_data, data = self._queue.popleft()
+                self._bytes -= len(data)
+                self._hits += 1
+                result = melodies_data, data
+            else:
+                self._misses += 1
+                result = None
+            hits, misses = self._hits, self._misses
+
+        logger.debug(f"prefetch {'hit' if result else 'miss'}: {hits} hits, {misses} misses")
+        return result
+
+    def schedule(self, params: Service.Params) -> None:
+        if params.seed is not None:
+            return  # A fixed seed gives the same variation every time
+        key = params.key()
+        with self._lock:
+            if key != self._key:
+                self._reset(key)
+            generation = self._generation
+        self._executor.submit(self._fill, params, generation)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._reset(None)
+
+    def _reset(self, key: Optional[tuple]) -> None:
+        self._key = key
+        self._generation += 1
+        self._queue.clear()
+        self._bytes = 0
+
+    def _is_full(self) -> bool:
+        return len(self._queue) >= self._size or self._bytes >= self._max_bytes
+
+    def _fill(self, params: Service.Params, generation: int) -> None:
+        try:
+            while True:
+                with self._lock:
+                    if generation != self._generation or self._is_full():
+                        return
+                melodies_data = Service.generate(params)
+                data = Service.render_midi(params, melodies_data)
+                with self._lock:
+                    if generation != self._generation:
+                        return
+                    self._queue.append((melodies_data, data))
+                    self._bytes += len(data)
+        except Exception:
+            logger.exception("Prefetch failed")
+
+
+HISTORY = History()
+PREFETCHER = Prefetcher()
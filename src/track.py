@@ -0,0 +1,71 @@
+"""
+Long practice tracks rendered bar by bar straight to a MIDI file
+
+python -m src.track -s "Am I-I" -r 4s -c Am F C G -b 1000 -o practice.mid
+"""
+
+import argparse
+import itertools
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.service import Service, Grid, MelodyEngine, Triad, MAJOR_CHORDS, MINOR_CHORDS
+
+
+def _parse_args(argv: Optional[list[str]]) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(prog="python -m src.track", description="Render a long track to a MIDI file")
+    parser.add_argument("-s", "--scale", required=True)
+    parser.add_argument("-r", "--rhythm")
+    parser.add_argument("-g", "--grid", type=int, choices=[g.value for g in Grid], default=Grid.EIGHTS.value)
+    parser.add_argument("--note-count", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=0.3, help="Chord tones threshold, 0..1")
+    parser.add_argument("-e", "--engine", choices=[e.value for e in MelodyEngine], default=MelodyEngine.UNIFORM.value)
+    parser.add_argument("-c", "--chords", nargs="+", choices=MAJOR_CHORDS + MINOR_CHORDS, required=True,
+                        help="Progression repeated over the whole track")
+    parser.add_argument("-b", "--bars", type=int, default=64)
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    Service.init_app_dir(background_tasks=False)
+    if args.scale not in Service.get_scale_names():
+        parser.error(f"unknown scale {args.scale!r}")
+    if args.rhythm is not None and args.rhythm not in Service.get_rhythm_names():
+        parser.error(f"unknown rhythm {args.rhythm!r}")
+
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+
+    args = _parse_args(argv)
+
+    grid = Grid(args.grid)
+    params = Service.Params(
+        bars=[],
+        scale_name=args.scale,
+        note_count=args.note_count,
+        grid=grid,
+        chord_tones_threshold=args.threshold,
+        rhythm_name=args.rhythm,
+        melody_engine=MelodyEngine(args.engine),
+        seed=args.seed
+    )
+    chords = itertools.islice(itertools.cycle([Triad(c) for c in args.chords]), args.bars)
+
+    start_time = time.perf_counter()
+    with open(args.output, "wb") as file:
+        bar_count = Service.write_midi_stream(params, chords, file)
+        size = file.tell()
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Rendered {bar_count} bars ({size / 1e6:.1f} MB) to {args.output} "
+        f"in {elapsed:.2f} s, {bar_count / elapsed:.0f} bars/s"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,18 @@
 Frontend part
 """
 
+from __future__ import annotations
+
 from collections import deque
 from typing import Optional, Callable
 
 import flet as ft
 
 from src.utils import trigonometry
+from src.utils.latest_executor import LatestExecutor
 from src.utils.logging_meta import LoggingMeta
-from src.service import Service, Grid, Pitch, MelodyData, Triad, MAJOR_CHORDS, MINOR_CHORDS
+from src.utils.paged_search import PagedSearch
+from src.service import Service, Grid, LibraryKind, MelodyData, MelodyEngine, Triad, MAJOR_CHORDS, MINOR_CHORDS
 
 
 class AppBar(ft.AppBar, metaclass=LoggingMeta):
@@ -17,24 +21,35 @@ class AppBar(ft.AppBar, metaclass=LoggingMeta):
     def __init__(self,
                  on_btn_settings_click: Callable,
                  on_btn_refresh_click: Callable,
-                 on_btn_folder_click: Callable
+                 on_btn_folder_click: Callable,
+                 on_btn_undo_click: Callable,
+                 on_btn_redo_click: Callable
                  ) -> None:
 
         self._btn_theme = ft.IconButton(ft.Icons.BRIGHTNESS_3, on_click=self._on_btn_theme_click)
         self._btn_settings = ft.IconButton(ft.Icons.SETTINGS, on_click=on_btn_settings_click)
         self._btn_refresh = ft.IconButton(ft.Icons.REFRESH, on_click=on_btn_refresh_click)
         self._btn_folder = ft.IconButton(ft.Icons.FOLDER, on_click=on_btn_folder_click)
+        self._btn_undo = ft.IconButton(ft.Icons.UNDO, on_click=on_btn_undo_click, disabled=True)
+        self._btn_redo = ft.IconButton(ft.Icons.REDO, on_click=on_btn_redo_click, disabled=True)
 
         super(AppBar, self).__init__(
             actions=[
                 self._btn_theme,
                 self._btn_settings,
+                self._btn_undo,
                 self._btn_refresh,
+                self._btn_redo,
                 self._btn_folder,
                 ft.Container(width=10)
             ]
         )
 
+    def set_history_state(self, can_undo: bool, can_redo: bool) -> None:
+        self._btn_undo.disabled = not can_undo
+        self._btn_redo.disabled = not can_redo
+        self.update()
+
     def _on_btn_theme_click(self, e: ft.ControlEvent) -> None:
 
         if self.page.theme_mode == ft.ThemeMode.LIGHT:
@@ -53,36 +68,59 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
 
         class Cell(ft.UserControl):
 
-            def __init__(self, grid: Grid, dark: bool, active: bool = True, pitch: Optional[Pitch] = None) -> None:
+            def __init__(self, grid: Grid, dark: bool, active: bool = True, label: Optional[str] = None) -> None:
                 super(BarsContainer.BarRow.Cell, self).__init__()
                 self._grid = grid
                 self._dark = dark
-                self._pitch = pitch
+                self._label = label
                 self._active = active
+                self._container: ft.Container = ...
+                self._btn_pitch: ft.ElevatedButton = ...
 
             def build(self) -> ft.Container:
 
-                if self._grid == Grid.SIXTEENTHS:
-                    width = 36
-                else:
-                    width = 72
-
-                if self._pitch:
-                    content = ft.ElevatedButton(self._pitch.name)
-                else:
-                    content = None
-
-                bgcolor = self._get_bgcolor()
+                self._btn_pitch = ft.ElevatedButton(
+                    self._label,
+                    visible=self._label is not None
+                )
 
-                return ft.Container(
+                self._container = ft.Container(
                     alignment=ft.alignment.center,
                     padding=3,
                     border_radius=3,
-                    width=width,
+                    width=self._get_width(),
                     height=36,
-                    bgcolor=bgcolor,
-                    content=content
+                    bgcolor=self._get_bgcolor(),
+                    content=self._btn_pitch
                 )
+                return self._container
+
+            @property
+            def label(self) -> Optional[str]:
+                return self._label
+
+            @label.setter
+            def label(self, label: Optional[str]) -> None:
+                """
+                Changes the label only, the caller is responsible for update()
+                """
+                self._label = label
+                if self._btn_pitch is not ...:
+                    self._btn_pitch.text = label
+                    self._btn_pitch.visible = label is not None
+
+            def reset(self, grid: Grid, dark: bool, active: bool, label: Optional[str]) -> None:
+                """
+                Reuses the cell for another grid position, the caller is responsible for update()
+                """
+                self._grid = grid
+                self._dark = dark
+                self._active = active
+                self.label = label
+                self.visible = True
+                if self._container is not ...:
+                    self._container.width = self._get_width()
+                    self._container.bgcolor = self._get_bgcolor()
 
             def switch_active(self) -> None:
                 self._active = not self._active
@@ -90,6 +128,13 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
                 self.controls[0].bgcolor = bgcolor
                 self.update()
 
+            def set_active(self, active: bool) -> None:
+                if self._active != active:
+                    self.switch_active()
+
+            def _get_width(self) -> int:
+                return 576 // self._grid.value  # 72 for eights, 36 for sixteenths
+
             def _get_bgcolor(self) -> ft.Colors:
 
                 light_color, dark_color = [ft.Colors.PRIMARY, ft.Colors.INVERSE_PRIMARY]
@@ -104,6 +149,8 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
             super(BarsContainer.BarRow, self).__init__()
             self._grid = grid
             self._melody_data = MelodyData.empty(grid)
+            self._note_names: dict[int, str] = {}
+            self._cells_pool: list[BarsContainer.BarRow.Cell] = []
             self._btn_chord: ft.OutlinedButton = ...
             self._row_cells: ft.Row = ...
             self._switch: ft.Switch = ...
@@ -137,7 +184,7 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
 
         @property
         def cells(self) -> list[Cell]:
-            return self._row_cells.controls
+            return self._cells_pool[:self._grid.value]
 
         @property
         def chord(self) -> Optional[Triad]:
@@ -146,23 +193,58 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
         @chord.setter
         def chord(self, chord: Optional[Triad]) -> None:
             self._btn_chord.data = chord
-            self._btn_chord.text = chord.name
+            self._btn_chord.text = chord.name if chord else " "
             self._btn_chord.update()
 
         @property
         def active(self) -> bool:
             return self._switch.value
 
+        @active.setter
+        def active(self, active: bool) -> None:
+            self._switch.value = active
+            self._switch.update()
+            for cell in self.cells:
+                cell.set_active(active)
+
         @property
         def melody_data(self) -> MelodyData:
             return self._melody_data
 
         @melody_data.setter
         def melody_data(self, melody_data: MelodyData) -> None:
+            """
+            Patches cells whose note changed, the caller is responsible for update()
+            """
+
+            old_notes = self._melody_data.notes
             self._melody_data = melody_data
-            self._row_cells.clean()
-            self._row_cells.controls = self._build_cells_for_melody_data()
-            self._row_cells.update()
+
+            if melody_data.grid != self._grid or len(old_notes) != len(melody_data.notes):
+                self._grid = melody_data.grid
+                self._row_cells.controls = self._build_cells_for_melody_data()
+                return
+
+            changed = [i for i, (old, new) in enumerate(zip(old_notes, melody_data.notes)) if old != new]
+            if changed:
+                labels = melody_data.labels(self._note_names)
+                for i in changed:
+                    self.cells[i].label = labels[i]
+
+        @property
+        def note_names(self) -> dict[int, str]:
+            return self._note_names
+
+        @note_names.setter
+        def note_names(self, note_names: dict[int, str]) -> None:
+            """
+            Relabels the cells with the spelling of a scale, the caller is responsible for update()
+            """
+            if note_names == self._note_names:
+                return
+            self._note_names = note_names
+            for cell, label in zip(self.cells, self._melody_data.labels(note_names)):
+                cell.label = label
 
         @property
         def params(self) -> dict:
@@ -177,22 +259,37 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
             self.melody_data = MelodyData.empty(grid)
 
         def _build_cells_for_melody_data(self) -> list[Cell]:
-
-            if self._grid == Grid.EIGHTS:
-                darks = [0, 0, 1, 1, 0, 0, 1, 1]
-            else:
-                darks = [0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 1, 1, 1, 1]
-            darks = [bool(d) for d in darks]
-
-            return [
-                BarsContainer.BarRow.Cell(
-                    grid=self._grid,
-                    dark=dark,
-                    active=self.active,
-                    pitch=pitch
+            """
+            Lays out the cells pool for the current grid.
+            Pooled cells are reset in place and cells beyond the grid are hidden,
+            new cells are created only when the pool is smaller than the grid
+            """
+
+            beat_cells = max(self._grid.value // 4, 1)
+            labels = self._melody_data.labels(self._note_names)
+
+            for idx, cell in enumerate(self._cells_pool):
+                if idx < self._grid.value:
+                    cell.reset(
+                        grid=self._grid,
+                        dark=bool(idx // beat_cells % 2),
+                        active=self.active,
+                        label=labels[idx]
+                    )
+                else:
+                    cell.visible = False
+
+            for idx in range(len(self._cells_pool), self._grid.value):
+                self._cells_pool.append(
+                    BarsContainer.BarRow.Cell(
+                        grid=self._grid,
+                        dark=bool(idx // beat_cells % 2),
+                        active=self.active,
+                        label=labels[idx]
+                    )
                 )
-                for dark, pitch in zip(darks, self._melody_data.scheme)
-            ]
+
+            return self._cells_pool
 
         def _on_btn_chord_click(self, e: ft.ControlEvent) -> None:
             if callable(self.on_btn_chord_click):
@@ -253,6 +350,19 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
     def melody_data(self, melody_data: list[MelodyData]) -> None:
         for bar, md in zip(self.bars, melody_data):
             bar.melody_data = md
+        self.update()
+
+    @property
+    def note_names(self) -> dict[int, str]:
+        return self._bar_1.note_names
+
+    @note_names.setter
+    def note_names(self, note_names: dict[int, str]) -> None:
+        """
+        Spelling of the scale for cell labels, the caller is responsible for update()
+        """
+        for bar in self.bars:
+            bar.note_names = note_names
 
     @property
     def bar_params(self) -> list[dict]:
@@ -262,12 +372,13 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
         self._grid = grid
         for bar in self.bars:
             bar.reset_grid(grid)
+        self.update()
 
     def set_chords(self, chords: list[Triad]) -> None:
         for bar, chord in zip(self.bars, chords):
             bar.chord = chord
 
-    def set_chord(self, chord: Triad, idx: int) -> None:
+    def set_chord(self, chord: Optional[Triad], idx: int) -> None:
         self.bars[idx].chord = chord
 
     def _on_btn_chord_click(self, bar: BarRow) -> None:
@@ -276,6 +387,135 @@ class BarsContainer(ft.UserControl, metaclass=LoggingMeta):
             self.on_btn_chord_click(idx)
 
 
+class SearchSelect(ft.UserControl, metaclass=LoggingMeta):
+    """
+    Type-ahead selector for large lists of names.
+    Matches are queried in pages and only the visible rows are rendered, rows scroll with the mouse wheel
+    """
+
+    VISIBLE_ROWS = 6
+
+    def __init__(self, label: str, search: PagedSearch, value: Optional[str] = None) -> None:
+        super(SearchSelect, self).__init__()
+        self._label = label
+        self._search = search
+        self._value = value
+        self._query = ""
+        self._offset = 0
+        self._total = 0
+        self._tf_query: ft.TextField = ...
+        self._rows: list[ft.TextButton] = []
+        self._txt_count: ft.Text = ...
+        self._btn_up: ft.IconButton = ...
+        self._btn_down: ft.IconButton = ...
+        self._col_list: ft.Column = ...
+
+    @property
+    def value(self) -> Optional[str]:
+        return self._value
+
+    def build(self) -> ft.Column:
+
+        self._tf_query = ft.TextField(
+            label=self._label,
+            value=self._value or "",
+            border=ft.InputBorder.OUTLINE,
+            border_color=ft.Colors.PRIMARY,
+            on_change=self._on_tf_query_change,
+            on_focus=self._on_tf_query_focus,
+            on_submit=self._on_tf_query_submit
+        )
+
+        self._rows = [
+            ft.TextButton(text="", visible=False, on_click=self._on_row_click)
+            for _ in range(self.VISIBLE_ROWS)
+        ]
+        self._txt_count = ft.Text(size=12)
+        self._btn_up = ft.IconButton(ft.Icons.KEYBOARD_ARROW_UP, on_click=lambda e: self._scroll(-self.VISIBLE_ROWS))
+        self._btn_down = ft.IconButton(ft.Icons.KEYBOARD_ARROW_DOWN, on_click=lambda e: self._scroll(self.VISIBLE_ROWS))
+
+        self._col_list = ft.Column(
+            controls=[
+                ft.GestureDetector(
+                    content=ft.Column(self._rows, spacing=0),
+                    on_scroll=self._on_list_scroll
+                ),
+                ft.Row([
+                    self._txt_count,
+                    self._btn_up,
+                    self._btn_down,
+                    ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: self._close())
+                ])
+            ],
+            spacing=0,
+            visible=False
+        )
+
+        return ft.Column([self._tf_query, self._col_list], width=240)
+
+    def _on_tf_query_focus(self, e: ft.ControlEvent) -> None:
+        self._search.clear()  # The library may have changed since the last time
+        self._open("" if self._tf_query.value == self._value else self._tf_query.value)
+
+    def _on_tf_query_change(self, e: ft.ControlEvent) -> None:
+        self._open(self._tf_query.value)
+
+    def _on_tf_query_submit(self, e: ft.ControlEvent) -> None:
+        if self._rows[0].visible:
+            self._select(self._rows[0].data)
+
+    def _on_row_click(self, e: ft.ControlEvent) -> None:
+        self._select(e.control.data)
+
+    def _on_list_scroll(self, e: ft.ScrollEvent) -> None:
+        if e.scroll_delta_y:
+            self._scroll(1 if e.scroll_delta_y > 0 else -1)
+
+    def _open(self, query: str) -> None:
+        self._query = query
+        self._offset = 0
+        self._col_list.visible = True
+        self._refresh_rows()
+
+    def _close(self) -> None:
+        self._tf_query.value = self._value or ""
+        self._col_list.visible = False
+        self.update()
+
+    def _select(self, value: str) -> None:
+        self._value = value
+        self._close()
+
+    def _scroll(self, delta: int) -> None:
+        offset = max(0, min(self._offset + delta, self._total - self.VISIBLE_ROWS))
+        if offset != self._offset:
+            self._offset = offset
+            self._refresh_rows()
+
+    def _refresh_rows(self) -> None:
+
+        self._total = self._search.count(self._query)
+        names = self._search.page(self._query, self._offset, self.VISIBLE_ROWS)
+
+        for row, name in zip(self._rows, names + [None] * (self.VISIBLE_ROWS - len(names))):
+            row.text = name or ""
+            row.data = name
+            row.visible = name is not None
+
+        shown = f"{self._offset + 1}-{self._offset + len(names)}" if names else "0"
+        self._txt_count.value = f"{shown} of {self._total}"
+        self._btn_up.disabled = self._offset == 0
+        self._btn_down.disabled = self._offset + len(names) >= self._total
+        self.update()
+
+
+def _get_library_search(kind: LibraryKind) -> PagedSearch:
+    return PagedSearch(
+        fetch=lambda query, offset, limit: Service.search_library(kind, query, offset=offset, limit=limit),
+        count=lambda query: Service.count_library(kind, query)
+    )
+
+
 class SettingsContainer(ft.UserControl, metaclass=LoggingMeta):
 
     def __init__(self, grid: Grid):
@@ -284,8 +524,9 @@ class SettingsContainer(ft.UserControl, metaclass=LoggingMeta):
         self._rg_grid: ft.RadioGroup = ...
         self._sld_note_count: ft.Slider = ...
         self._sld_ct_threshold: ft.Slider = ...
-        self._dd_scale: ft.Dropdown = ...
-        self._dd_rhythm: ft.Dropdown = ...
+        self._sel_scale: SearchSelect = ...
+        self._sel_rhythm: SearchSelect = ...
+        self._dd_engine: ft.Dropdown = ...
         self.on_grid_change: Callable = ...
 
     def build(self) -> ft.Container:
@@ -315,20 +556,24 @@ class SettingsContainer(ft.UserControl, metaclass=LoggingMeta):
             value=30
         )
 
-        scales = Service.get_scale_names()
-        self._dd_scale = ft.Dropdown(
-            options=[ft.dropdown.Option(s) for s in scales],
+        scales = Service.search_library(LibraryKind.SCALES, limit=1)
+        self._sel_scale = SearchSelect(
             label="Scale",
-            value=scales[0] if scales else None,
-            border=ft.InputBorder.OUTLINE,
-            border_color=ft.Colors.PRIMARY
+            search=_get_library_search(LibraryKind.SCALES),
+            value=scales[0] if scales else None
         )
 
-        rhythms = Service.get_rhythm_names()
-        self._dd_rhythm = ft.Dropdown(
-            options=[ft.dropdown.Option(r) for r in rhythms],
+        rhythms = Service.search_library(LibraryKind.RHYTHMS, limit=1)
+        self._sel_rhythm = SearchSelect(
             label="Rhythm",
-            value=rhythms[0] if rhythms else None,
+            search=_get_library_search(LibraryKind.RHYTHMS),
+            value=rhythms[0] if rhythms else None
+        )
+
+        self._dd_engine = ft.Dropdown(
+            options=[ft.dropdown.Option(e.value) for e in MelodyEngine],
+            label="Melody",
+            value=MelodyEngine.UNIFORM.value,
             border=ft.InputBorder.OUTLINE,
             border_color=ft.Colors.PRIMARY
         )
@@ -348,10 +593,11 @@ class SettingsContainer(ft.UserControl, metaclass=LoggingMeta):
                 ft.Text("Chord tones treshold"),
                 self._sld_ct_threshold,
                 ft.Row(
-                    controls=[self._dd_scale, self._dd_rhythm],
-                    alignment=ft.MainAxisAlignment.SPACE_EVENLY
+                    controls=[self._sel_scale, self._sel_rhythm, self._dd_engine],
+                    alignment=ft.MainAxisAlignment.SPACE_EVENLY,
+                    vertical_alignment=ft.CrossAxisAlignment.START
                 )
-            ])
+            ], scroll=ft.ScrollMode.AUTO)
         )
 
     @property
@@ -360,22 +606,40 @@ class SettingsContainer(ft.UserControl, metaclass=LoggingMeta):
             "grid": Grid.EIGHTS if self._rg_grid.value == "8" else Grid.SIXTEENTHS,
             "note_count": int(self._sld_note_count.value),
             "chord_tones_threshold": self._sld_ct_threshold.value * 0.01,
-            "scale": self._dd_scale.value,
-            "rhythm": self._dd_rhythm.value
+            "scale": self._sel_scale.value,
+            "rhythm": self._sel_rhythm.value,
+            "melody_engine": MelodyEngine(self._dd_engine.value)
         }
 
+    @property
+    def grid(self) -> Grid:
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid: Grid) -> None:
+        """
+        Sets the grid without calling on_grid_change
+        """
+        self._rg_grid.value = str(grid.value)
+        self._rg_grid.update()
+        self._set_grid(grid)
+
     def _on_rg_grid_change(self, e: ft.ControlEvent) -> None:
 
-        self._grid = self.settings["grid"]
+        self._set_grid(self.settings["grid"])
+
+        if callable(self.on_grid_change):
+            self.on_grid_change(self._grid)
+
+    def _set_grid(self, grid: Grid) -> None:
+
+        self._grid = grid
 
         self._sld_note_count.max = self._grid.value
         self._sld_note_count.divisions = self._grid.value - 1
         self._sld_note_count.value = 6 if self._grid.value == 16 else 4
         self._sld_note_count.update()
 
-        if callable(self.on_grid_change):
-            self.on_grid_change(self._grid)
-
 
 class CircleContainer(ft.UserControl, metaclass=LoggingMeta):
 
@@ -461,7 +725,10 @@ class MainStack(ft.UserControl, metaclass=LoggingMeta):
         self._cont_bars: BarsContainer = ...
         self._cont_settings: SettingsContainer = ...
         self._cont_circle: CircleContainer = ...
+        self._progress_bar: ft.ProgressBar = ...
         self._bar_idx_to_set_chord: Optional[int] = None
+        self._refresh_executor = LatestExecutor("refresh")
+        self.on_history_change: Callable = ...
 
     def build(self) -> ft.Stack:
 
@@ -476,10 +743,13 @@ class MainStack(ft.UserControl, metaclass=LoggingMeta):
         self._cont_settings.on_grid_change = self._on_settings_grid_change
         self._cont_circle.on_btn_chord_click = self._on_circle_chord_click
 
+        self._progress_bar = ft.ProgressBar(width=800, visible=False)
+
         return ft.Stack([
             self._cont_bars,
             self._cont_settings,
-            self._cont_circle
+            self._cont_circle,
+            self._progress_bar
         ])
 
     @property
@@ -504,12 +774,62 @@ class MainStack(ft.UserControl, metaclass=LoggingMeta):
 
     def on_btn_refresh_click(self, e: ft.ControlEvent) -> None:
         params = self._collect_params()
-        result = Service.process_four_bars(params)
-        self.melody_data = result
+        self._set_refreshing(True)
+        self._refresh_executor.submit(
+            lambda token: Service.process_four_bars(params, token),
+            on_done=lambda result: self._on_refresh_done(result, params.scale_name),
+            on_error=self._on_refresh_error
+        )
 
     def on_btn_folder_click(self, e: ft.ControlEvent) -> None:
         Service.open_app_folder()
 
+    def on_btn_undo_click(self, e: ft.ControlEvent) -> None:
+        self._set_refreshing(True)
+        self._refresh_executor.submit(
+            Service.undo,
+            on_done=self._on_history_done,
+            on_error=self._on_refresh_error
+        )
+
+    def on_btn_redo_click(self, e: ft.ControlEvent) -> None:
+        self._set_refreshing(True)
+        self._refresh_executor.submit(
+            Service.redo,
+            on_done=self._on_history_done,
+            on_error=self._on_refresh_error
+        )
+
+    def _on_refresh_done(self, result: list[MelodyData], scale_name: str) -> None:
+        self._cont_bars.note_names = Service.get_note_names(scale_name)
+        self.melody_data = result
+        self._set_refreshing(False)
+        self._notify_history_change()
+
+    def _on_history_done(self, params: Optional[Service.Params]) -> None:
+        if params is not None:
+            if params.grid != self._cont_settings.grid:
+                self._cont_settings.grid = params.grid
+                self._cont_bars.reset_grid(params.grid)
+            for idx, bar in enumerate(params.bars):
+                self._cont_bars.set_chord(bar.chord, idx)
+                self._cont_bars.bars[idx].active = bar.active
+            self._cont_bars.note_names = Service.get_note_names(params.scale_name)
+            self.melody_data = [bar.melody_data for bar in params.bars]
+        self._set_refreshing(False)
+        self._notify_history_change()
+
+    def _notify_history_change(self) -> None:
+        if callable(self.on_history_change):
+            self.on_history_change(Service.can_undo(), Service.can_redo())
+
+    def _on_refresh_error(self, exc: BaseException) -> None:
+        self._set_refreshing(False)
+
+    def _set_refreshing(self, refreshing: bool) -> None:
+        self._progress_bar.visible = refreshing
+        self._progress_bar.update()
+
     def _on_bars_chord_click(self, idx: int) -> None:
         self._bar_idx_to_set_chord = idx
         self._cont_circle.visible = True
@@ -539,5 +859,6 @@ class MainStack(ft.UserControl, metaclass=LoggingMeta):
             grid=settings["settings"]["grid"],
             chord_tones_threshold=settings["settings"]["chord_tones_threshold"],
             rhythm_name=settings["settings"]["rhythm"],
+            melody_engine=settings["settings"]["melody_engine"]
         )
         return params
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class AliasTable:
+    """
+    Walker/Vose alias tables for a (rows, n) matrix of weights,
+    each row is sampled in O(1) with one uniform number in [0, 1).
+    Rows without positive weights are sampled uniformly
+    """
+
+    def __init__(self, weights: np.ndarray) -> None:
+
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim == 1:
+            weights = weights[np.newaxis]
+
+        rows, n = weights.shape
+        self._n = n
+        self._prob = np.ones((rows, n), dtype=np.float64)
+        self._alias = np.tile(np.arange(n, dtype=np.int64), (rows, 1))
+
+        for row in range(rows):
+            self._build_row(row, np.clip(weights[row], 0, None))
+
+        # Plain lists are faster than numpy indexing for one sample at a time
+        self._prob_rows = self._prob.tolist()
+        self._alias_rows = self._alias.tolist()
+
+    def __len__(self) -> int:
+        return self._n
+
+    def sample(self, row: int, u: float) -> int:
+        u *= self._n
+        idx = min(int(u), self._n - 1)  # u * n rounds up to n for u close to 1
+        return idx if u - idx < self._prob_rows[row][idx] else self._alias_rows[row][idx]
+
+    def sample_many(self, rows: np.ndarray, u: np.ndarray) -> np.ndarray:
+        u = u * self._n
+        idx = np.minimum(u.astype(np.int64), self._n - 1)
+        flat_idx = rows * self._n + idx
+        keep = (u - idx) < self._prob.ravel()[flat_idx]
+        return np.where(keep, idx, self._alias.ravel()[flat_idx])
+
+    def _build_row(self, row: int, weights: np.ndarray) -> None:
+
+        total = weights.sum()
+        if total <= 0:
+            return
+
+        scaled = weights * (self._n / total)
+        small = [i for i in range(self._n) if scaled[i] < 1]
+        large = [i for i in range(self._n) if scaled[i] >= 1]
+
+        while small and large:
+            s, g = small.pop(), large.pop()
+            self._prob[row, s] = scaled[s]
+            self._alias[row, s] = g
+            scaled[g] -= 1 - scaled[s]
+            (small if scaled[g] < 1 else large).append(g)
+
+        # Leftovers are 1 up to rounding errors
+        for i in small + large:
+            self._prob[row, i] = 1
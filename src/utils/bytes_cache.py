@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from src.utils.folder import Folder
+
+
+class BytesCache:
+    """
+    LRU cache of bytes by string key bounded by total size,
+    with an optional on-disk tier of one file per key
+    """
+
+    def __init__(self, max_bytes: int, folder: Optional[Folder] = None, suffix: str = ".bin") -> None:
+        self._max_bytes = max_bytes
+        self._folder = folder
+        self._suffix = suffix
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def folder(self) -> Optional[Folder]:
+        return self._folder
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "items": len(self._items), "bytes": self._bytes}
+
+    def get(self, key: str) -> Optional[bytes]:
+
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self._hits += 1
+                return data
+
+        data = self._read_disk(key)
+
+        with self._lock:
+            if data is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._put_memory(key, data)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._put_memory(key, data)
+        self._write_disk(key, data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._items[key] = data
+        self._bytes += len(data)
+        while self._bytes > self._max_bytes and self._items:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if self._folder is None:
+            return None
+        try:
+            with open(self._folder.path / (key + self._suffix), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if self._folder is None:
+            return
+        self._folder.create()
+        with open(self._folder.path / (key + self._suffix), "wb") as file:
+            file.write(data)
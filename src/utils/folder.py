@@ -10,7 +10,7 @@ class Folder:
     def __init__(self, path: Union[str, Path], auto_create=False) -> None:
         self._path = Path(path)
         if auto_create:
-            os.makedirs(self._path, exist_ok=True)
+            self.create()
 
     @property
     def path(self) -> Path:
@@ -23,6 +23,9 @@ class Folder:
     def exists(self) -> bool:
         return self._path.exists()
 
+    def create(self) -> None:
+        os.makedirs(self._path, exist_ok=True)
+
     def clear(self):
         for child in self._path.iterdir():
             if child.is_dir():
@@ -0,0 +1,150 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Callable, Union
+
+from loguru import logger
+
+
+# Upper bounds of histogram buckets in milliseconds, the last bucket is unbounded
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+_NULL_SPAN = nullcontext()
+
+
+class _Histogram:
+
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms: float) -> None:
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th percentile
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + [self.max], self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total / self.count,
+            "min_ms": self.min,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "buckets_ms": dict(zip([str(b) for b in BUCKETS_MS] + ["inf"], self.buckets))
+        }
+
+
+class LatencyRecorder:
+    """
+    Wall-clock latency histograms per named span.
+    When disabled, span() returns a shared no-op context and nothing is recorded
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: dict[str, _Histogram] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self) -> None:
+        self._enabled = True
+
+    def disable(self) -> None:
+        self._enabled = False
+
+    def span(self, name: str):
+        if not self._enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self._enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram()
+            histogram.add(seconds * 1000)
+
+    def report(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: h.to_dict() for name, h in sorted(self._histograms.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def save_json(self, path: Union[str, Path]) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def log_line(self) -> str:
+        return "; ".join(
+            f"{name} n={r['count']} mean={r['mean_ms']:.1f}ms p90={r['p90_ms']:.1f}ms"
+            for name, r in self.report().items()
+        )
+
+    def log_periodically(self, interval: float) -> threading.Thread:
+
+        def loop() -> None:
+            while True:
+                time.sleep(interval)
+                if self._histograms:
+                    logger.info(f"latency: {self.log_line()}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    @contextmanager
+    def _span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+
+LATENCY = LatencyRecorder(enabled=os.environ.get("FOUR_BARS_LATENCY", "") not in ("", "0"))
@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken:
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class LatestExecutor:
+    """
+    Runs tasks one at a time in a worker thread, only the latest submitted task counts.
+    A new submission cancels the pending task and the token of the running one,
+    callbacks are called only for the latest task
+    """
+
+    def __init__(self, name: str = "latest") -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._future: Optional[Future] = None
+        self._token: Optional[CancelToken] = None
+
+    @property
+    def busy(self) -> bool:
+        future = self._future
+        return future is not None and not future.done()
+
+    def submit(
+            self,
+            func: Callable[[CancelToken], Any],
+            on_done: Optional[Callable[[Any], None]] = None,
+            on_error: Optional[Callable[[BaseException], None]] = None
+    ) -> CancelToken:
+
+        with self._lock:
+            self.cancel()
+            token = CancelToken()
+            future = self._executor.submit(func, token)
+            self._future = future
+            self._token = token
+
+        def done_callback(f: Future) -> None:
+            if f.cancelled() or token.cancelled:
+                return
+            exc = f.exception()
+            if isinstance(exc, TaskCancelled):
+                return
+            if exc is not None:
+                logger.opt(exception=exc).error("Task failed")
+                if callable(on_error):
+                    on_error(exc)
+            elif callable(on_done):
+                on_done(f.result())
+
+        future.add_done_callback(done_callback)
+        return token
+
+    def cancel(self) -> None:
+        if self._future is not None:
+            self._future.cancel()
+        if self._token is not None:
+            self._token.cancel()
+
+    def shutdown(self) -> None:
+        self.cancel()
+        self._executor.shutdown(wait=False)
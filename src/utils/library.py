@@ -0,0 +1,193 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS entries_order ON entries (kind, source_id, position);
+CREATE TABLE IF NOT EXISTS tags (
+    kind TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (kind, name, tag)
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (kind, tag);
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    signature TEXT,
+    UNIQUE (kind, source)
+);
+"""
+
+
+class Library:
+    """
+    SQLite index of named entries of several kinds, e.g. scales and rhythms.
+    Entries come from sources such as YAML files, are loaded one at a time
+    and are searched by name and tags without loading them.
+    A "tags" key of a mapping entry is stored as its tags
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def get(self, kind: str, name: str) -> Any:
+        row = self._query_one("SELECT data FROM entries WHERE kind = ? AND name = ?", (kind, name))
+        return json.loads(row[0]) if row else None
+
+    def get_tags(self, kind: str, name: str) -> list[str]:
+        rows = self._query("SELECT tag FROM tags WHERE kind = ? AND name = ? ORDER BY tag", (kind, name))
+        return [tag for tag, in rows]
+
+    def names(
+            self,
+            kind: str,
+            query: str = "",
+            tag: Optional[str] = None,
+            offset: int = 0,
+            limit: Optional[int] = None
+    ) -> list[str]:
+        """
+        Names containing query, case-insensitive, in order of sources and of entries within them
+        """
+        where, args = self._where(kind, query, tag)
+        rows = self._query(
+            f"SELECT name FROM entries WHERE {where} ORDER BY source_id, position LIMIT ? OFFSET ?",
+            args + (-1 if limit is None else limit, offset)
+        )
+        return [name for name, in rows]
+
+    def count(self, kind: str, query: str = "", tag: Optional[str] = None) -> int:
+        where, args = self._where(kind, query, tag)
+        return self._query_one(f"SELECT COUNT(*) FROM entries WHERE {where}", args)[0]
+
+    def signature(self, kind: str, source: str) -> Optional[str]:
+        row = self._query_one("SELECT signature FROM sources WHERE kind = ? AND source = ?", (kind, source))
+        return row[0] if row else None
+
+    def import_entries(self, kind: str, source: str, entries: dict, signature: Optional[str] = None) -> set[str]:
+        """
+        Replaces entries of the source with entries, returns names whose data or tags changed
+        """
+
+        rows = {}
+        for position, (name, value) in enumerate((entries or {}).items()):
+            name = str(name)
+            tags = []
+            if isinstance(value, dict) and "tags" in value:
+                value = dict(value)
+                tags = sorted({str(t) for t in value.pop("tags") or []})
+            rows[name] = (position, json.dumps(value, sort_keys=True), tags)
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO sources (kind, source, signature) VALUES (?, ?, ?) "
+                    "ON CONFLICT (kind, source) DO UPDATE SET signature = excluded.signature",
+                    (kind, source, signature)
+                )
+                source_id, = connection.execute(
+                    "SELECT id FROM sources WHERE kind = ? AND source = ?", (kind, source)
+                ).fetchone()
+
+                old = {
+                    name: (data, old_source_id)
+                    for name, data, old_source_id in connection.execute(
+                        "SELECT name, data, source_id FROM entries WHERE kind = ?", (kind,)
+                    )
+                }
+                old_tags: dict[str, list[str]] = {}
+                for name, tag in connection.execute("SELECT name, tag FROM tags WHERE kind = ? ORDER BY tag", (kind,)):
+                    old_tags.setdefault(name, []).append(tag)
+
+                removed = {
+                    name for name, (_, old_source_id) in old.items()
+                    if old_source_id == source_id and name not in rows
+                }
+                changed = removed | {
+                    name for name, (_, data, tags) in rows.items()
+                    if name not in old or old[name][0] != data or old_tags.get(name, []) != tags
+                }
+
+                connection.executemany(
+                    "DELETE FROM entries WHERE kind = ? AND name = ?", [(kind, name) for name in removed]
+                )
+                connection.executemany(
+                    "DELETE FROM tags WHERE kind = ? AND name = ?", [(kind, name) for name in changed]
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO entries (kind, name, source_id, position, data) VALUES (?, ?, ?, ?, ?)",
+                    [(kind, name, source_id, position, data) for name, (position, data, _) in rows.items()]
+                )
+                connection.executemany(
+                    "INSERT INTO tags (kind, tag, name) VALUES (?, ?, ?)",
+                    [(kind, tag, name) for name in changed - removed for tag in rows[name][2]]
+                )
+
+        return changed
+
+    def export_entries(self, kind: str) -> dict:
+        """
+        All entries of the kind with their tags, in the shape they were imported
+        """
+
+        result = {}
+        for name in self.names(kind):
+            value = self.get(kind, name)
+            tags = self.get_tags(kind, name)
+            if tags and isinstance(value, dict):
+                value["tags"] = tags
+            result[name] = value
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _where(self, kind: str, query: str, tag: Optional[str]) -> tuple[str, tuple]:
+        where = "kind = ?"
+        args: tuple = (kind,)
+        if query:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where += " AND name LIKE ? ESCAPE '\\'"
+            args += (f"%{escaped}%",)
+        if tag:
+            where += " AND name IN (SELECT name FROM tags WHERE kind = ? AND tag = ?)"
+            args += (kind, tag)
+        return where, args
+
+    def _query(self, sql: str, args: tuple) -> list[tuple]:
+        with self._lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    def _query_one(self, sql: str, args: tuple) -> Optional[tuple]:
+        with self._lock:
+            return self._connect().execute(sql, args).fetchone()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.executescript(_SCHEMA)
+        return self._connection
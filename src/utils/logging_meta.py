@@ -1,7 +1,15 @@
+import inspect
+
 from loguru import logger
 
+from src.utils.latency import LATENCY
+
 
 class LoggingMeta(type):
+    """
+    Wraps every callable with logger.catch.
+    When latency recording is enabled, functions are also timed as "<class>.<function>"
+    """
 
     def __new__(mcs, name, bases, local):
         for attr in local:
@@ -9,5 +17,7 @@ class LoggingMeta(type):
             if value.__class__ is type:
                 continue
             if callable(value):
+                if LATENCY.enabled and inspect.isfunction(value):
+                    value = LATENCY.wrap(f"{name}.{attr}", value)
                 local[attr] = logger.catch(value)
         return type.__new__(mcs, name, bases, local)
@@ -0,0 +1,308 @@
+import heapq
+import struct
+from os import PathLike
+from typing import BinaryIO, Iterable, NamedTuple, Optional, Union
+
+
+class NoteEvent(NamedTuple):
+    offset: float  # In quarter lengths
+    duration: float  # In quarter lengths
+    pitch: int
+    velocity: int = 90
+
+
+class EncodedChunk(NamedTuple):
+    """
+    Note messages of a time span encoded for a track, spans are joined with join_chunks
+    """
+    first_delta: int  # Ticks from the span start to the first message
+    body: bytes  # Messages after the first delta
+    trailing: int  # Ticks from the last message to the span end
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(">III", self.first_delta, self.trailing, len(self.body)) + self.body
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0) -> tuple["EncodedChunk", int]:
+        """
+        Chunk at offset and offset of the next one, ValueError if the data ends before the chunk does
+        """
+        first_delta, trailing, size = struct.unpack_from(">III", data, offset)
+        start = offset + 12
+        if start + size > len(data):
+            raise ValueError(f"Chunk at {offset} needs {size} bytes, {len(data) - start} are left")
+        return cls(first_delta, data[start:start + size], trailing), start + size
+
+
+def encode_chunk(
+        notes: Iterable[NoteEvent],
+        length: float,
+        ticks_per_quarter: int = 10080,
+        channel: int = 0
+) -> EncodedChunk:
+    """
+    Notes of a span of length quarter lengths, offsets are from the span start
+    """
+
+    messages = _note_messages(notes, ticks_per_quarter, channel)
+    length_ticks = round(length * ticks_per_quarter)
+    if not messages:
+        return EncodedChunk(0, b"", length_ticks)
+
+    first_tick, _, first_msg = messages[0]
+    body = first_msg + _encode_messages(messages[1:], first_tick)
+    return EncodedChunk(first_tick, body, length_ticks - messages[-1][0])
+
+
+def join_chunks(chunks: Iterable[EncodedChunk]) -> bytes:
+    """
+    Track messages of consecutive spans
+    """
+
+    data = bytearray()
+    pending = 0
+    for chunk in chunks:
+        if chunk.body:
+            data += _var_len(pending + chunk.first_delta)
+            data += chunk.body
+            pending = chunk.trailing
+        else:
+            pending += chunk.trailing
+    return bytes(data)
+
+
+class MidiFile:
+    """
+    Minimal Standard MIDI File (format 1) writer
+    """
+
+    def __init__(self, tempo: int = 120, ticks_per_quarter: int = 10080) -> None:
+        self._tempo = tempo
+        self._ticks_per_quarter = ticks_per_quarter
+        self._tracks: list[bytes] = []  # Encoded messages without end of track
+
+    @property
+    def tempo(self) -> int:
+        return self._tempo
+
+    @property
+    def ticks_per_quarter(self) -> int:
+        return self._ticks_per_quarter
+
+    def add_track(self, notes: Iterable[NoteEvent], channel: int = 0) -> None:
+        self._tracks.append(_encode_messages(_note_messages(notes, self._ticks_per_quarter, channel), 0))
+
+    def add_encoded_track(self, data: bytes) -> None:
+        """
+        Track of messages encoded with the same ticks_per_quarter, e.g. by join_chunks
+        """
+        self._tracks.append(data)
+
+    def to_bytes(self) -> bytes:
+        chunks = [self._conductor_chunk()]
+        chunks.extend(_chunk(b"MTrk", data + _END_OF_TRACK) for data in self._tracks)
+        header = struct.pack(">4sIHHH", b"MThd", 6, 1, len(chunks), self._ticks_per_quarter)
+        return header + b"".join(chunks)
+
+    def save(self, path: Union[str, PathLike]) -> None:
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    def _conductor_chunk(self) -> bytes:
+        return _chunk(b"MTrk", _conductor_events(self._tempo) + _END_OF_TRACK)
+
+
+class MidiStreamWriter:
+    """
+    Standard MIDI File (format 0) written to a seekable binary file block by block.
+    Notes of a block must not start before the notes already written,
+    note-offs wait until their time comes, the track length is patched on close
+    """
+
+    _BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, file: BinaryIO, tempo: int = 120, ticks_per_quarter: int = 10080) -> None:
+        self._file = file
+        self._ticks_per_quarter = ticks_per_quarter
+        self._pending_offs: list[tuple[int, int, bytes]] = []  # Heap of (tick, pitch, message)
+        self._tick = 0
+        self._length = 0
+        self._buffer = bytearray()
+        self._closed = False
+
+        self._file.write(struct.pack(">4sIHHH", b"MThd", 6, 0, 1, ticks_per_quarter))
+        self._length_pos = self._file.tell() + 4
+        self._file.write(b"MTrk\x00\x00\x00\x00")
+        self._buffer += _conductor_events(tempo)
+
+    def __enter__(self) -> "MidiStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def write(self, notes: Iterable[NoteEvent], channel: int = 0) -> None:
+
+        ons = []
+        for note in notes:
+            on = round(note.offset * self._ticks_per_quarter)
+            off = round((note.offset + note.duration) * self._ticks_per_quarter)
+            if on < self._tick:
+                raise ValueError(f"Note at {note.offset} starts before already written notes")
+            ons.append((on, note.pitch, bytes([0x90 | channel, note.pitch, note.velocity])))
+            heapq.heappush(self._pending_offs, (off, note.pitch, bytes([0x80 | channel, note.pitch, 0])))
+        ons.sort()
+
+        for tick, _, msg in ons:
+            self._write_offs(until=tick)
+            self._write_message(tick, msg)
+
+        if len(self._buffer) >= self._BUFFER_SIZE:
+            self._flush()
+
+    def close(self) -> None:
+
+        if self._closed:
+            return
+        self._closed = True
+
+        self._write_offs(until=None)
+        self._buffer += _END_OF_TRACK
+        self._flush()
+
+        end_pos = self._file.tell()
+        self._file.seek(self._length_pos)
+        self._file.write(self._length.to_bytes(4, "big"))
+        self._file.seek(end_pos)
+
+    def _write_offs(self, until: Optional[int]) -> None:
+        while self._pending_offs and (until is None or self._pending_offs[0][0] <= until):
+            tick, _, msg = heapq.heappop(self._pending_offs)
+            self._write_message(tick, msg)
+
+    def _write_message(self, tick: int, msg: bytes) -> None:
+        self._buffer += _var_len(tick - self._tick)
+        self._buffer += msg
+        self._tick = tick
+
+    def _flush(self) -> None:
+        self._file.write(self._buffer)
+        self._length += len(self._buffer)
+        self._buffer.clear()
+
+
+def read_messages(data: bytes) -> list[tuple[float, bytes]]:
+    """
+    Channel messages of a Standard MIDI File with their times in seconds, tracks merged.
+    At the same time note-offs go first, meta and system exclusive events are skipped
+    """
+
+    _, _, format_, track_count, division = struct.unpack_from(">4sIHHH", data, 0)
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+
+    events = []  # (tick, 0 for note-off or 1, track index, message)
+    tempos = [(0, 500_000)]  # (tick, microseconds per quarter)
+    pos = 14
+    for track_idx in range(track_count):
+        tag, length = struct.unpack_from(">4sI", data, pos)
+        pos += 8
+        end = pos + length
+        if tag != b"MTrk":
+            pos = end
+            continue
+
+        tick, status = 0, 0
+        while pos < end:
+            delta, pos = _read_var_len(data, pos)
+            tick += delta
+            if data[pos] & 0x80:
+                status = data[pos]
+                pos += 1
+            if status == 0xff:
+                meta_type = data[pos]
+                size, pos = _read_var_len(data, pos + 1)
+                if meta_type == 0x51:
+                    tempos.append((tick, int.from_bytes(data[pos:pos + 3], "big")))
+                pos += size
+            elif status in (0xf0, 0xf7):
+                size, pos = _read_var_len(data, pos)
+                pos += size
+            else:
+                size = 1 if status & 0xf0 in (0xc0, 0xd0) else 2
+                msg = bytes([status]) + data[pos:pos + size]
+                pos += size
+                is_off = status & 0xf0 == 0x80 or (status & 0xf0 == 0x90 and msg[2] == 0)
+                events.append((tick, 0 if is_off else 1, track_idx if format_ == 1 else 0, msg))
+        pos = end
+
+    events.sort(key=lambda e: e[:3])
+    tempos.sort(key=lambda t: t[0])
+
+    messages = []
+    tempo_idx, tempo_tick, tempo_seconds = 0, 0, 0.0
+    for tick, _, _, msg in events:
+        while tempo_idx + 1 < len(tempos) and tempos[tempo_idx + 1][0] <= tick:
+            tempo_seconds += (tempos[tempo_idx + 1][0] - tempo_tick) * tempos[tempo_idx][1] / division / 1e6
+            tempo_idx += 1
+            tempo_tick = tempos[tempo_idx][0]
+        messages.append((tempo_seconds + (tick - tempo_tick) * tempos[tempo_idx][1] / division / 1e6, msg))
+    return messages
+
+
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+def _note_messages(notes: Iterable[NoteEvent], ticks_per_quarter: int, channel: int) -> list[tuple[int, int, bytes]]:
+    """
+    (tick, 0 for off or 1 for on, message) sorted by time, note-offs go first
+    """
+
+    messages = []
+    for note in notes:
+        on = round(note.offset * ticks_per_quarter)
+        off = round((note.offset + note.duration) * ticks_per_quarter)
+        messages.append((on, 1, bytes([0x90 | channel, note.pitch, note.velocity])))
+        messages.append((off, 0, bytes([0x80 | channel, note.pitch, 0])))
+    messages.sort(key=lambda m: (m[0], m[1]))
+    return messages
+
+
+def _encode_messages(messages: list[tuple[int, int, bytes]], tick: int) -> bytes:
+    data = bytearray()
+    for msg_tick, _, msg in messages:
+        data += _var_len(msg_tick - tick)
+        data += msg
+        tick = msg_tick
+    return bytes(data)
+
+
+def _conductor_events(tempo: int) -> bytes:
+    mpq = round(60_000_000 / tempo)
+    return (
+        b"\x00\xff\x51\x03" + mpq.to_bytes(3, "big")
+        + b"\x00\xff\x58\x04\x04\x02\x18\x08"
+    )
+
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    return tag + len(data).to_bytes(4, "big") + data
+
+
+def _read_var_len(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _var_len(value: int) -> bytes:
+    result = [value & 0x7f]
+    value >>= 7
+    while value:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    return bytes(reversed(result))
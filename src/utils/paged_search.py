@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class _Result:
+
+    __slots__ = ("total", "pages")
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.pages: dict[int, list[str]] = {}
+
+    def names(self) -> Optional[list[str]]:
+        """
+        All matches if they are loaded
+        """
+        if self.total == 0:
+            return []
+        if self.total > len(self.pages.get(0, ())):
+            return None
+        return self.pages[0]
+
+
+class PagedSearch:
+    """
+    Page cache of a substring search over names, per query.
+    A query containing a cached query with all matches loaded is filtered in memory
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[str, int, int], list[str]],
+            count: Callable[[str], int],
+            page_size: int = 50,
+            max_queries: int = 64
+    ) -> None:
+        self._fetch = fetch
+        self._count = count
+        self._page_size = page_size
+        self._max_queries = max_queries
+        self._lock = threading.Lock()
+        self._results: OrderedDict[str, _Result] = OrderedDict()
+
+    def count(self, query: str) -> int:
+        return self._get_result(query).total
+
+    def page(self, query: str, offset: int, limit: int) -> list[str]:
+
+        result = self._get_result(query)
+        names = []
+        first_page = offset // self._page_size
+        last_page = (min(offset + limit, result.total) - 1) // self._page_size
+        for page_idx in range(first_page, last_page + 1):
+            page = result.pages.get(page_idx)
+            if page is None:
+                page = self._fetch(query, page_idx * self._page_size, self._page_size)
+                with self._lock:
+                    result.pages[page_idx] = page
+            names += page
+
+        start = offset - first_page * self._page_size
+        return names[start:start + limit]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def _get_result(self, query: str) -> _Result:
+
+        with self._lock:
+            result = self._results.get(query)
+            if result is not None:
+                self._results.move_to_end(query)
+                return result
+            narrower = self._filter_cached(query)
+
+        if narrower is not None:
+            result = _Result(len(narrower))
+            result.pages = {
+                i // self._page_size: narrower[i:i + self._page_size] for i in range(0, len(narrower), self._page_size)
+            }
+        else:
+            result = _Result(self._count(query))
+
+        with self._lock:
+            self._results[query] = result
+            while len(self._results) > self._max_queries:
+                self._results.popitem(last=False)
+        return result
+
+    def _filter_cached(self, query: str) -> Optional[list[str]]:
+        for cached_query, result in reversed(self._results.items()):
+            names = result.names()
+            if names is not None and cached_query.lower() in query.lower():
+                return [name for name in names if query.lower() in name.lower()]
+        return None
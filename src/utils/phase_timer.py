@@ -0,0 +1,44 @@
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from loguru import logger
+
+
+class PhaseTimer:
+    """
+    Wall-clock durations of named phases, each one is logged when it ends
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._start = time.perf_counter()
+        self._phases: dict[str, float] = {}
+
+    @property
+    def phases(self) -> dict[str, float]:
+        return dict(self._phases)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def timed(self, name: str, func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def mark(self, name: str) -> None:
+        """
+        Records time elapsed since the timer was created
+        """
+        self._record(name, time.perf_counter() - self._start)
+
+    def _record(self, name: str, seconds: float) -> None:
+        self._phases[name] = seconds
+        logger.info(f"{self._name}: {name} took {seconds * 1000:.1f} ms")
@@ -0,0 +1,46 @@
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from src.utils.folder import Folder
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Limits for files in a folder, the oldest files are evicted first
+    """
+
+    max_files: Optional[int] = None
+    max_bytes: Optional[int] = None
+    max_age: Optional[float] = None  # Seconds
+
+    def apply(self, folder: Folder, suffix: str) -> list[Path]:
+
+        entries = []
+        with os.scandir(folder.path) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        entries.sort()
+
+        now = time.time()
+        file_count = len(entries)
+        total_bytes = sum(size for _, size, _ in entries)
+
+        evicted = []
+        for mtime, size, path in entries:
+            too_many = self.max_files is not None and file_count > self.max_files
+            too_big = self.max_bytes is not None and total_bytes > self.max_bytes
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            if not (too_many or too_big or too_old):
+                break
+            path.unlink(missing_ok=True)
+            file_count -= 1
+            total_bytes -= size
+            evicted.append(path)
+
+        return evicted
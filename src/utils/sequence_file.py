@@ -0,0 +1,40 @@
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+
+class SequenceFile:
+    """
+    Persistent monotonic counter stored as a number in a text file.
+    The file is read once, initial is used when there is no file yet
+    """
+
+    def __init__(self, path: Union[str, Path], initial: Callable[[], int] = lambda: 0) -> None:
+        self._path = Path(path)
+        self._initial = initial
+        self._value: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def next(self) -> int:
+        with self._lock:
+            if self._value is None:
+                self._value = self._load()
+            self._value += 1
+            self._save(self._value)
+            return self._value
+
+    def _load(self) -> int:
+        try:
+            return int(self._path.read_text(encoding="utf-8").strip())
+        except (FileNotFoundError, ValueError):
+            return self._initial()
+
+    def _save(self, value: int) -> None:
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        tmp_path.write_text(str(value), encoding="utf-8")
+        os.replace(tmp_path, self._path)
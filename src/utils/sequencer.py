@@ -0,0 +1,198 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Sequence
+
+from src.utils.latency import LATENCY, LatencyRecorder
+
+try:
+    import rtmidi
+except ImportError:
+    rtmidi = None
+
+
+class MidiSink(ABC):
+    """
+    Output of Sequencer messages
+    """
+
+    @abstractmethod
+    def send(self, message: bytes) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class RecordingSink(MidiSink):
+    """
+    Keeps sent messages with their perf_counter times instead of playing them
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._messages: list[tuple[float, bytes]] = []
+
+    @property
+    def messages(self) -> list[tuple[float, bytes]]:
+        with self._lock:
+            return list(self._messages)
+
+    def send(self, message: bytes) -> None:
+        sent = time.perf_counter()
+        with self._lock:
+            self._messages.append((sent, message))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._messages.clear()
+
+
+class RtMidiSink(MidiSink):
+    """
+    MIDI output port opened with python-rtmidi, the first port whose name contains port_name
+    """
+
+    def __init__(self, port_name: str = "") -> None:
+
+        if rtmidi is None:
+            raise RuntimeError("python-rtmidi is not installed")
+
+        self._out = rtmidi.MidiOut()
+        ports = self._out.get_ports()
+        matching = [i for i, name in enumerate(ports) if port_name.lower() in name.lower()]
+        if not matching:
+            del self._out
+            raise RuntimeError(f"No MIDI output port matching {port_name!r}, available: {ports}")
+
+        self._name = ports[matching[0]]
+        self._out.open_port(matching[0])
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def send(self, message: bytes) -> None:
+        self._out.send_message(message)
+
+    def close(self) -> None:
+        self._out.close_port()
+
+
+class Sequencer:
+    """
+    Plays timed MIDI messages to a sink from a scheduler thread.
+    play() replaces the current playback, notes still sounding are released first.
+    The thread sleeps until SPIN_SECONDS before a message is due and spins on perf_counter after.
+    If the latency recorder is enabled, lateness of the first message after play() and of the rest
+    is recorded as "sequencer.start" and "sequencer.jitter" spans
+    """
+
+    SPIN_SECONDS = 0.002
+
+    def __init__(self, sink: MidiSink, latency: LatencyRecorder = LATENCY) -> None:
+        self._sink = sink
+        self._latency = latency
+        self._cond = threading.Condition()
+        self._pending: Optional[tuple[float, Sequence[tuple[float, bytes]]]] = None  # (play() time, messages)
+        self._playing = False
+        self._closed = False
+        self._sounding: set[tuple[int, int]] = set()  # (channel, pitch)
+        self._thread = threading.Thread(target=self._run, name="sequencer", daemon=True)
+        self._thread.start()
+
+    @property
+    def sink(self) -> MidiSink:
+        return self._sink
+
+    @property
+    def playing(self) -> bool:
+        with self._cond:
+            return self._playing or self._pending is not None
+
+    def play(self, messages: Sequence[tuple[float, bytes]]) -> None:
+        """
+        Messages with their times in seconds from the start, sorted by time
+        """
+        requested = time.perf_counter()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Sequencer is closed")
+            self._pending = (requested, messages)
+            self._cond.notify_all()
+
+    def stop(self) -> None:
+        self.play([])
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until playback ends, returns False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._playing and self._pending is None, timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._sink.close()
+
+    def _run(self) -> None:
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    break
+                (requested, messages), self._pending = self._pending, None
+                self._playing = True
+
+            self._release_notes()
+            if messages:
+                self._play(requested, messages)
+
+            with self._cond:
+                self._playing = False
+                self._cond.notify_all()
+
+        self._release_notes()
+
+    def _play(self, start: float, messages: Sequence[tuple[float, bytes]]) -> None:
+
+        for idx, (at, message) in enumerate(messages):
+            due = start + at
+            if not self._wait_until(due):
+                return
+
+            self._sink.send(message)
+            self._track_note(message)
+
+            if self._latency.enabled:
+                self._latency.record("sequencer.start" if idx == 0 else "sequencer.jitter", time.perf_counter() - due)
+
+    def _wait_until(self, due: float) -> bool:
+        """
+        False if playback was replaced or the sequencer closed while waiting
+        """
+        while True:
+            if self._pending is not None or self._closed:
+                return False
+            remaining = due - time.perf_counter()
+            if remaining <= 0:
+                return True
+            if remaining > self.SPIN_SECONDS:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending is not None or self._closed, remaining - self.SPIN_SECONDS)
+
+    def _track_note(self, message: bytes) -> None:
+        kind, channel = message[0] & 0xf0, message[0] & 0x0f
+        if kind == 0x90 and message[2]:
+            self._sounding.add((channel, message[1]))
+        elif kind in (0x80, 0x90):
+            self._sounding.discard((channel, message[1]))
+
+    def _release_notes(self) -> None:
+        for channel, pitch in sorted(self._sounding):
+            self._sink.send(bytes([0x80 | channel, pitch, 0]))
+        self._sounding.clear()
@@ -1,8 +1,20 @@
+import threading
 from pathlib import Path
-from typing import Union
+from typing import Callable, Optional, Union
 
 import yaml
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 class YAMLFile:
 
@@ -23,11 +35,95 @@ class YAMLFile:
 
     def read(self) -> Union[dict, list, None]:
         with open(self._path, "r", encoding="utf-8") as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=Loader)
 
     def write(self, data: Union[dict, list, None]) -> None:
         with open(self._path, "w", encoding="utf-8") as file:
-            yaml.safe_dump(data, file)
+            yaml.dump(data, file, Dumper=Dumper)
 
     def delete(self) -> None:
         self._path.unlink()
+
+
+class CachedYAMLFile(YAMLFile):
+    """
+    YAMLFile that is parsed once and reloaded when its mtime or size changes.
+    Listeners receive the set of top-level keys whose values changed
+    """
+
+    def __init__(self, path: Union[str, Path], auto_create=False) -> None:
+        self._lock = threading.RLock()
+        self._data = None
+        self._loaded = False
+        self._signature: Optional[tuple[int, int]] = None
+        self._listeners: list[Callable[[set], None]] = []
+        self._observer = None
+        super(CachedYAMLFile, self).__init__(path, auto_create)
+
+    def read(self) -> Union[dict, list, None]:
+        with self._lock:
+            signature = self._stat()
+            if self._loaded and signature == self._signature:
+                return self._data
+            old_data, was_loaded = self._data, self._loaded
+            self._data = super(CachedYAMLFile, self).read()
+            self._signature = signature
+            self._loaded = True
+            data = self._data
+        if was_loaded:
+            changed = _changed_keys(old_data, data)
+            if changed:
+                for listener in self._listeners:
+                    listener(changed)
+        return data
+
+    def write(self, data: Union[dict, list, None]) -> None:
+        with self._lock:
+            super(CachedYAMLFile, self).write(data)
+            self._signature = None
+        self.read()
+
+    def subscribe(self, listener: Callable[[set], None]) -> None:
+        self._listeners.append(listener)
+
+    def watch(self) -> None:
+        """
+        Reload on file system events, if watchdog is available
+        """
+
+        if Observer is None or self._observer is not None:
+            return
+        self._observer = Observer()
+        self._observer.daemon = True
+        self._observer.schedule(_EventHandler(self), str(self._path.parent), recursive=False)
+        self._observer.start()
+
+    def unwatch(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _stat(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = self._path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+class _EventHandler(FileSystemEventHandler):
+
+    def __init__(self, yaml_file: CachedYAMLFile) -> None:
+        super(_EventHandler, self).__init__()
+        self._yaml_file = yaml_file
+
+    def on_any_event(self, event) -> None:
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        if str(self._yaml_file.path) in paths and self._yaml_file.exists():
+            self._yaml_file.read()
+
+
+def _changed_keys(old: Union[dict, list, None], new: Union[dict, list, None]) -> set:
+    old = old if isinstance(old, dict) else {}
+    new = new if isinstance(new, dict) else {}
+    return {k for k in old.keys() | new.keys() if old.get(k) != new.get(k)}
@@ -0,0 +1,10 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Set before src.service is imported, it reads them at import time
+_APP_DIR = tempfile.mkdtemp(prefix="four_bars_test_")
+atexit.register(shutil.rmtree, _APP_DIR, ignore_errors=True)
+os.environ["FOUR_BARS_APP_DIR"] = _APP_DIR
+os.environ.pop("FOUR_BARS_RENDER_CACHE", None)
@@ -0,0 +1,55 @@
+import pytest
+
+from src.service import Service, Grid, MelodyData, MidiBackend, Triad, RENDER_CACHE
+from src.utils.midi_file import read_messages
+
+
+CHORDS = ["Am", "F", "C", "G"]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def app_dir():
+    Service.init_app_dir(background_tasks=False)
+
+
+def _note_events(data: bytes) -> list[tuple[float, bool, int, int]]:
+    """
+    (time, is note-on, pitch, velocity) of note messages, note-ons with velocity 0 are note-offs
+    """
+
+    events = []
+    for at, message in read_messages(data):
+        kind = message[0] & 0xf0
+        if kind not in (0x80, 0x90):
+            continue
+        is_on = kind == 0x90 and message[2] > 0
+        events.append((round(at, 6), is_on, message[1], message[2] if is_on else 0))
+    return sorted(events)
+
+
+@pytest.mark.parametrize("grid", list(Grid))
+@pytest.mark.parametrize("rhythm_name", ["8s", None])
+def test_native_and_music21_backends_play_same_notes(grid: Grid, rhythm_name: str):
+
+    params = Service.Params(
+        bars=[
+            Service.Params.BarParams(chord=Triad(chord), active=True, melody_data=MelodyData.empty(grid))
+            for chord in CHORDS
+        ],
+        scale_name="Am I-I",
+        note_count=grid.value // 2,
+        grid=grid,
+        chord_tones_threshold=0.3,
+        rhythm_name=rhythm_name,
+        seed=1
+    )
+    melodies_data = Service.generate(params)
+
+    rendered = {}
+    for backend in MidiBackend:
+        RENDER_CACHE.clear()
+        params.midi_backend = backend
+        rendered[backend] = _note_events(Service.render_midi(params, melodies_data))
+
+    assert rendered[MidiBackend.NATIVE]
+    assert rendered[MidiBackend.NATIVE] == rendered[MidiBackend.MUSIC21]